@@ -0,0 +1,818 @@
+'''
+Benchmarks for the processing stages of the pipeline. Each benchmark is a
+sub-command; run from the repository root, eg:
+
+    python benchmark.py xml downloads/10.3897/phytokeys.22.4041.xml
+    python benchmark.py backends downloads/
+    python benchmark.py corpus downloads/
+    python benchmark.py articles downloads/
+    python benchmark.py fetch --count 200 --workers 1 8
+    python benchmark.py captions --count 100000
+    python benchmark.py parity downloads/ --reference HEAD --synthetic 100000
+    python benchmark.py split --specimens 10 100 1000
+    python benchmark.py segments --count 1000000
+    python benchmark.py dataframe --segments 1000 10000 100000 1000000
+
+Every measured run happens in a fresh interpreter, so that its peak
+memory (resident set size) can be reported separately.
+'''
+
+import argparse
+import filecmp
+import json
+import os
+import pickle
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+def peakRss() -> int:
+    '''Returns the peak resident set size of this process in bytes'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def runChild(*args) -> dict:
+    '''Runs "benchmark.py <args>" in a new interpreter and returns the measurements it prints'''
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), *args],
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def printTable(rows: list, headers: list) -> None:
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+def findArticles(paths: list) -> list:
+    '''Returns the XML articles among paths, looking inside the directories'''
+    articles = []
+    for path in paths:
+        if not os.path.isdir(path):
+            articles.append(path)
+            continue
+        for directory, _, file_names in os.walk(path):
+            articles += [os.path.join(directory, name) for name in sorted(file_names)
+                         if name.endswith(('.xml', '.xml.gz'))]
+    return articles
+
+def sameOutput(output_file: str, other_file: str) -> bool:
+    '''Whether two species-descriptions.txt files, and their figure stores if any, are identical'''
+    from functions.figureStoreFunctions import figureStorePath
+    stores = [figureStorePath(output_file), figureStorePath(other_file)]
+    if os.path.exists(stores[0]) != os.path.exists(stores[1]):
+        return False
+    return filecmp.cmp(output_file, other_file, shallow=False) and \
+        (not os.path.exists(stores[0]) or filecmp.cmp(*stores, shallow=False))
+
+def xmlChild(input_file: str, output_file: str, mode: str) -> None:
+    from xml2illustrationdata import xml2illustrations
+    start = time.perf_counter()
+    xml2illustrations(input_file, output_file, None, download_images=False, backend=mode)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'peak_rss': peakRss()}))
+
+def benchmarkXml(input_files: list, repeat: int) -> None:
+    '''
+    Compares the backends of xml2illustrations (BeautifulSoup, lxml and
+    streaming with lxml iterparse): runtime, peak RSS and whether the
+    output is identical to the BeautifulSoup one
+    '''
+    from xml2illustrationdata import BACKENDS
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for input_file in findArticles(input_files):
+            outputs = {}
+            for mode in BACKENDS:
+                outputs[mode] = os.path.join(tmp_dir, mode + '.txt')
+                runs = [runChild('xml-child', input_file, outputs[mode], mode) for _ in range(repeat)]
+                identical = sameOutput(outputs['soup'], outputs[mode])
+                rows.append([os.path.basename(input_file), mode,
+                             '{:.3f}'.format(min(run['seconds'] for run in runs)),
+                             '{:.1f}'.format(max(run['peak_rss'] for run in runs) / 2 ** 20),
+                             '' if mode == 'soup' else 'yes' if identical else 'NO'])
+    printTable(rows, ['Article', 'Mode', 'Seconds', 'Peak RSS (MB)', 'Identical'])
+
+def benchmarkBackends(input_files: list) -> bool:
+    '''
+    Times every figure accessor of the BeautifulSoup backend (figureFunctions)
+    against the lxml one (lxmlFunctions) on all the figures of the articles,
+    and checks that they return identical values, as do the records of the
+    streaming backend. Returns whether everything was identical.
+    '''
+    from bs4 import BeautifulSoup
+    import functions.figureFunctions as figureFunctions
+    import functions.lxmlFunctions as lxmlFunctions
+    from functions.streamFunctions import iterFigureRecords
+
+    from functions.compressionFunctions import openArticle
+
+    backends = {'soup': (lambda path: BeautifulSoup(openArticle(path, 'r', encoding='utf-8').read(), 'xml').find_all('fig'),
+                         figureFunctions.ACCESSORS),
+                'lxml': (lambda path: lxmlFunctions.getFigures(lxmlFunctions.parseArticle(path)),
+                         lxmlFunctions.ACCESSORS)}
+    seconds = {backend: {} for backend in backends}
+    # Backend -> field -> values of every figure of every article
+    values = {backend: {} for backend in backends}
+    articles = findArticles(input_files)
+    for input_file in articles:
+        for backend, (parse, accessors) in backends.items():
+            start = time.perf_counter()
+            figures = parse(input_file)
+            seconds[backend]['parse'] = seconds[backend].get('parse', 0.0) + time.perf_counter() - start
+            for field, accessor in accessors.items():
+                start = time.perf_counter()
+                results = [accessor(figure) for figure in figures]
+                seconds[backend][field] = seconds[backend].get(field, 0.0) + time.perf_counter() - start
+                values[backend].setdefault(field, []).extend(results)
+        streamed = list(iterFigureRecords(input_file))
+        for field in figureFunctions.ACCESSORS:
+            values.setdefault('streaming', {}).setdefault(field, []).extend(getattr(record, field) for record in streamed)
+
+    rows = []
+    all_identical = True
+    for field in ['parse'] + list(figureFunctions.ACCESSORS):
+        soup_seconds, lxml_seconds = seconds['soup'][field], seconds['lxml'][field]
+        if field == 'parse':
+            identical = ''
+        else:
+            identical = values['soup'][field] == values['lxml'][field] == values['streaming'][field]
+            all_identical = all_identical and identical
+            identical = 'yes' if identical else 'NO'
+        rows.append([field, '{:.3f}'.format(soup_seconds), '{:.3f}'.format(lxml_seconds),
+                     '{:.1f}'.format(soup_seconds / lxml_seconds) if lxml_seconds else '-', identical])
+    soup_total, lxml_total = sum(seconds['soup'].values()), sum(seconds['lxml'].values())
+    rows.append(['total', '{:.3f}'.format(soup_total), '{:.3f}'.format(lxml_total),
+                 '{:.1f}'.format(soup_total / lxml_total), 'yes' if all_identical else 'NO'])
+    print('{} articles, {} figures'.format(len(articles), len(values['soup']['label'])))
+    printTable(rows, ['Function', 'soup (s)', 'lxml (s)', 'Speedup', 'Identical'])
+    return all_identical
+
+def benchmarkCorpus(download_prefix: str, processes: int) -> None:
+    '''
+    Compares processing every article in download_prefix with one
+    interpreter per article, as make does, against the corpus mode of
+    xml2illustrationdata.py, and checks that the outputs are identical
+    '''
+    from xml2illustrationdata import doi2dataPath, findDownloadedDois
+    from doi2xml import doi2path
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xml2illustrationdata.py')
+    dois = findDownloadedDois(download_prefix)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        serial_prefix, corpus_prefix = os.path.join(tmp_dir, 'serial'), os.path.join(tmp_dir, 'corpus')
+
+        start = time.perf_counter()
+        for doi in dois:
+            output_file = doi2dataPath(doi, serial_prefix)
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            subprocess.run([sys.executable, script, doi2path(doi, download_prefix), output_file], check=True)
+        serial_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        command = [sys.executable, script, '--corpus', '--download_prefix', download_prefix,
+                   '--data_prefix', corpus_prefix]
+        if processes:
+            command += ['--processes', str(processes)]
+        subprocess.run(command, check=True, capture_output=True)
+        corpus_seconds = time.perf_counter() - start
+
+        identical = all(sameOutput(doi2dataPath(doi, serial_prefix), doi2dataPath(doi, corpus_prefix)) for doi in dois)
+    printTable([['process per article', '{:.2f}'.format(serial_seconds), '1.0', ''],
+                ['corpus', '{:.2f}'.format(corpus_seconds), '{:.1f}'.format(serial_seconds / corpus_seconds),
+                 'yes' if identical else 'NO']],
+               ['{} articles'.format(len(dois)), 'Seconds', 'Speedup', 'Identical'])
+
+def evictFromPageCache(path: str) -> None:
+    '''Drops the file at path from the page cache, so that it is read from disk again (Linux)'''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def articlesChild(article_dir: str, backend: str, cache: str) -> None:
+    '''
+    Runs xml2illustrations on every article in article_dir, after bringing
+    the articles into (warm) or out of (cold) the page cache. The stored
+    section indexes are removed first, so every article is read in full.
+    '''
+    from xml2illustrationdata import xml2illustrations
+    articles = findArticles([article_dir])
+    for directory, _, file_names in os.walk(article_dir):
+        for name in file_names:
+            if name.endswith('.sections.json'):
+                os.remove(os.path.join(directory, name))
+    for article in articles:
+        if cache == 'cold':
+            evictFromPageCache(article)
+        else:
+            with open(article, 'rb') as f_in:
+                while f_in.read(1024 * 1024):
+                    pass
+    output_file = os.path.join(article_dir, 'output', 'species-descriptions.txt')
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    start = time.perf_counter()
+    for article in articles:
+        xml2illustrations(article, output_file, None, download_images=False, backend=backend)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'peak_rss': peakRss()}))
+
+def directorySize(path: str) -> int:
+    '''Returns the total size in bytes of the files in the directory at path'''
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, file_names in os.walk(path) for name in file_names)
+
+def benchmarkArticles(input_files: list, backend: str, repeat: int) -> None:
+    '''
+    Compares storing the downloaded articles as plain XML against gzip
+    compressed XML: size on disk, of the articles and of the copies kept in
+    the HTTP cache, and end to end read time (section index and figure
+    extraction by xml2illustrations) when the files are in the page cache
+    (warm) and when they have to be read from disk (cold). The articles are
+    downloaded by dois2xml from a local stand-in server, so that they and
+    the cache are stored just as doi2xml.py stores them.
+    '''
+    from doi2xml import dois2xml
+    from functions.compressionFunctions import openArticle
+    from functions.httpFunctions import HttpCache, configureScheduler
+    if not hasattr(os, 'posix_fadvise'):
+        print('Files cannot be evicted from the page cache on this platform, so cold runs are warm too')
+    articles = findArticles(input_files)
+    bodies = {}
+    for i, article in enumerate(articles):
+        with openArticle(article) as f_in:
+            bodies[str(i)] = f_in.read()
+    dois = ['10.3897/standin.{}'.format(i) for i in range(len(articles))]
+    server, base_url = startStandInServer(bodies, 0, {})
+    configureScheduler(rate=1e6, burst=len(dois))
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(articles[0]))) as tmp_dir:
+            for storage, compressed in [('xml', False), ('gzip', True)]:
+                article_dir = os.path.join(tmp_dir, storage)
+                cache = HttpCache(os.path.join(tmp_dir, storage + '-cache'), compressed=compressed)
+                if dois2xml(dois, article_dir, resolver=base_url + '/doi/',
+                            xml_url=base_url + '/article/{article_id}/download/xml/', cache=cache,
+                            compressed=compressed):
+                    raise SystemExit('The articles could not be downloaded from the stand-in server')
+                article_size = sum(os.path.getsize(path) for path in findArticles([article_dir]))
+                cache_size = directorySize(cache.cache_dir)
+                row = [storage] + ['{:.1f}'.format(size / 2 ** 20)
+                                   for size in (article_size, cache_size, article_size + cache_size)]
+                for cache_state in ['cold', 'warm']:
+                    runs = [runChild('articles-child', article_dir, backend, cache_state) for _ in range(repeat)]
+                    row.append('{:.3f}'.format(min(run['seconds'] for run in runs)))
+                rows.append(row)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print('{} articles, {} backend'.format(len(articles), backend))
+    printTable(rows, ['Storage', 'Articles (MB)', 'HTTP cache (MB)', 'Total (MB)', 'Cold (s)', 'Warm (s)'])
+
+def standInArticle(doi: str) -> bytes:
+    '''Returns a small XML article for doi, served by the stand-in server when no articles are given'''
+    paragraphs = ''.join('<p>Solanum sp{} is known from {} collections.</p>'.format(i, i * 7) for i in range(200))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<article><front><article-meta>'
+            '<article-id pub-id-type="doi">{}</article-id></article-meta></front>'
+            '<body>{}</body></article>\n'.format(doi, paragraphs)).encode('utf8')
+
+def startStandInServer(bodies: dict, latency: float, statistics: dict):
+    '''
+    Starts a local HTTP server standing in for doi.org and the PhytoKeys
+    site: HEAD /doi/<doi> redirects to /article/<id>/, and
+    GET /article/<id>/download/xml/ returns bodies[id] with an ETag,
+    honouring If-None-Match. Every request waits latency seconds, as over
+    the network. Requests and connections are counted in statistics.
+    Returns the server and its base url.
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import hashlib
+    import socket
+    import threading
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            statistics[key] = statistics.get(key, 0) + 1
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # Headers and body are sent separately: without this, the body waits for the client's delayed ACK
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            count('connections')
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, headers=(), body=b''):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            time.sleep(latency)
+            count('HEAD')
+            if not self.path.startswith('/doi/'):
+                return self.reply(404)
+            article_id = self.path.rsplit('.', 1)[-1]
+            self.reply(302, [('Location', '/article/{}/'.format(article_id))])
+
+        def do_GET(self):
+            time.sleep(latency)
+            parts = self.path.strip('/').split('/')
+            if len(parts) != 4 or parts[0] != 'article' or parts[2:] != ['download', 'xml'] or parts[1] not in bodies:
+                count('GET 404')
+                return self.reply(404)
+            body = bodies[parts[1]]
+            etag = '"{}"'.format(hashlib.sha256(body).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                count('GET 304')
+                return self.reply(304, [('ETag', etag)])
+            count('GET 200')
+            self.reply(200, [('Content-Type', 'application/xml'), ('ETag', etag)], body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+def benchmarkFetch(input_files: list, count: int, workers_counts: list, latency: float) -> bool:
+    '''
+    Downloads count articles with dois2xml from a local stand-in server,
+    for each number of workers: first with an empty DOI index and HTTP
+    cache (cold), then again with both filled (warm), which should resolve
+    no DOI and download no article body. Checks that every stored article
+    is the one served, and that no more connections are opened than there
+    are workers. Returns whether all the checks passed.
+    '''
+    from doi2xml import DoiIndex, doi2path, dois2xml
+    from functions.compressionFunctions import openArticle
+    from functions.httpFunctions import HttpCache, configureScheduler
+    articles = findArticles(input_files)
+    dois = ['10.3897/standin.{}'.format(i) for i in range(count)]
+    bodies = {}
+    for i, doi in enumerate(dois):
+        if articles:
+            with openArticle(articles[i % len(articles)]) as f_in:
+                bodies[str(i)] = f_in.read()
+        else:
+            bodies[str(i)] = standInArticle(doi)
+    statistics = {}
+    server, base_url = startStandInServer(bodies, latency, statistics)
+    # Rate limited by the latency of the stand-in server only
+    configureScheduler(rate=1e6, burst=count)
+    rows = []
+    all_passed = True
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for workers in workers_counts:
+                doi_index = DoiIndex(os.path.join(tmp_dir, 'index{}.sqlite'.format(workers)))
+                cache = HttpCache(os.path.join(tmp_dir, 'cache{}'.format(workers)), compressed=True)
+                for run in ['cold', 'warm']:
+                    download_prefix = os.path.join(tmp_dir, 'downloads{}-{}'.format(workers, run))
+                    statistics.clear()
+                    start = time.perf_counter()
+                    failures = dois2xml(dois, download_prefix, workers, resolver=base_url + '/doi/',
+                                        xml_url=base_url + '/article/{article_id}/download/xml/',
+                                        doi_index=doi_index, cache=cache)
+                    seconds = time.perf_counter() - start
+                    identical = True
+                    for i, doi in enumerate(dois):
+                        with openArticle(doi2path(doi, download_prefix)) as f_in:
+                            identical = identical and f_in.read() == bodies[str(i)]
+                    # Keep-alive connections are reused: at most one per worker
+                    passed = not failures and identical and statistics.get('connections', 0) <= workers and \
+                        (run == 'cold' or statistics.get('HEAD', 0) == statistics.get('GET 200', 0) == 0)
+                    all_passed = all_passed and passed
+                    rows.append([workers, run, '{:.2f}'.format(seconds), statistics.get('HEAD', 0),
+                                 statistics.get('GET 200', 0), statistics.get('GET 304', 0),
+                                 statistics.get('connections', 0), 'yes' if passed else 'NO'])
+                doi_index.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    print('{} articles, {:.0f} ms latency'.format(count, latency * 1000))
+    printTable(rows, ['Workers', 'Run', 'Seconds', 'HEAD', 'GET 200', 'GET 304', 'Connections', 'Passed'])
+    return all_passed
+
+# Pieces of synthetic captions, modelled on PhytoKeys figure captions
+COLLECTORS = ['Knapp', 'Nee', 'Cárdenas', 'Hunziker', 'Smith', 'Wood', 'Særkinen', 'Peña', 'Barboza', 'Orejuela']
+PARTS = ['habit', 'flower', 'fruit', 'leaf', 'seed', 'calyx', 'flowering branch', 'inflorescence']
+SOURCES = ['Drawn by Bobbi Angell.', 'Photograph credits: S. Knapp.', 'Illustration by R. Jones.', 'Photos by T. Særkinen.',
+           'Reproduced from Knapp (2002).', 'Courtesy of the herbarium.', '']
+
+def syntheticCaption(rng, taxon_name: str) -> list:
+    '''
+    Returns the strings of a random caption as (string, is_bold) pairs:
+    labelled panels, scale bars, herbarium specimens or drawings
+    '''
+    collection = '{} {}'.format(rng.choice(COLLECTORS), rng.randrange(10, 9999))
+    letters = 'ABCDEFGHIJKL'[:rng.randrange(2, 12)]
+    kind = rng.randrange(5)
+    if kind == 0:
+        strings = [(taxon_name, False), ('. ', False)]
+        for letter in letters:
+            strings += [(letter, True), (' {} '.format(rng.choice(PARTS)), False)]
+        return strings + [('({}). {}'.format(collection, rng.choice(SOURCES)), False)]
+    if kind == 1:
+        strings = []
+        for letter in letters:
+            strings += [(letter, True), (' {} {} mm '.format(rng.choice(PARTS), rng.randrange(1, 9)), False)]
+        return strings + [(rng.choice(SOURCES), False)]
+    if kind == 2:
+        strings = []
+        for letter in letters:
+            strings += [(letter, True), (' {} '.format(rng.choice(PARTS)), False)]
+        scale_bars = 'Scale bars: {} = 5 cm; {} = 1 cm. '.format(letters[0], letters[-1])
+        return strings + [(scale_bars + rng.choice(SOURCES), False)]
+    if kind == 3:
+        return [('Herbarium specimen of ', False), (taxon_name, False),
+                (' – holotype, Peru, {} (K). Photograph credit: RBG Kew.'.format(collection), False)]
+    return [(taxon_name, False), (' drawn from {}. {}'.format(collection, rng.choice(SOURCES)), False)]
+
+def syntheticRecords(count: int, seed: int = 0) -> list:
+    '''Returns count FigureRecords with random captions'''
+    from functions.figureFunctions import FigureRecord
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        taxon_name = 'Solanum sp{}'.format(i)
+        strings = syntheticCaption(rng, taxon_name)
+        text = ''.join(string for string, _ in strings)
+        records.append(FigureRecord(label='Figure {}'.format(i + 1), taxon_name=taxon_name, description='',
+                                    section='Description', caption_text=text, url='', text=text,
+                                    strings=[string for string, _ in strings],
+                                    bolds=[string for string, bold in strings if bold]))
+    return records
+
+def benchmarkCaptions(count: int, repeat: int) -> None:
+    '''Times the parsing of count synthetic captions, without and with the caption cache'''
+    from functions.cacheFunctions import CaptionCache
+    from functions.figureFunctions import getLetterCount, getLoopBoldCount, getSegmentedText
+    records = syntheticRecords(count)
+
+    def segment(parse=getSegmentedText):
+        for record in records:
+            try:
+                parse(record)
+            except (IndexError, ValueError):
+                # Captions the parser cannot segment, as with real articles
+                pass
+
+    def countPanels():
+        for record in records:
+            getLetterCount(record)
+            getLoopBoldCount(record)
+
+    def timeStage(stage, setup=None):
+        runs = []
+        for i in range(repeat):
+            argument = setup(i) if setup else None
+            start = time.perf_counter()
+            stage(argument) if setup else stage()
+            runs.append(time.perf_counter() - start)
+            if setup:
+                argument.close()
+        return min(runs)
+
+    rows = []
+    for name, stage in [('getSegmentedText', segment), ('getLetterCount/getLoopBoldCount', countPanels)]:
+        seconds = timeStage(stage)
+        rows.append([name, '{:.3f}'.format(seconds), '{:.0f}'.format(count / seconds)])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Every cold run starts from an empty cache, every warm run reads the one filled first
+        warm_path = os.path.join(tmp_dir, 'warm.sqlite')
+        filling = CaptionCache(warm_path)
+        segment(filling.getSegmentedText)
+        filling.close()
+        cached = [('CaptionCache, empty', lambda i: CaptionCache(os.path.join(tmp_dir, 'cold{}.sqlite'.format(i)))),
+                  ('CaptionCache, filled', lambda i: CaptionCache(warm_path))]
+        statistics = []
+        for name, setup in cached:
+            caches = []
+            def openCache(i, setup=setup):
+                caches.append(setup(i))
+                return caches[-1]
+            seconds = timeStage(lambda cache: (cache.prefetch(records), segment(cache.getSegmentedText)), openCache)
+            rows.append([name, '{:.3f}'.format(seconds), '{:.0f}'.format(count / seconds)])
+            statistics.append('{}: {}'.format(name, caches[-1].statistics()))
+    printTable(rows, ['{} captions'.format(count), 'Seconds', 'Captions/s'])
+    for line in statistics:
+        print(line)
+
+# Fields a FigureRecord is built from, passed by name between the trees compared by the parity check
+RECORD_FIELDS = ['label', 'taxon_name', 'description', 'section', 'caption_text', 'url', 'xml', 'text', 'strings', 'bolds']
+
+def parityChild(tree: str, records_file: str, results_file: str) -> None:
+    '''
+    Segments the captions pickled in records_file with the getSegmentedText
+    of the functions package in tree, and pickles the results (or the name
+    of the exception raised) to results_file
+    '''
+    sys.path.insert(0, tree)
+    from functions.figureFunctions import FigureRecord, getSegmentedText
+    with open(records_file, 'rb') as f_in:
+        records = pickle.load(f_in)
+    results = []
+    for fields in records:
+        try:
+            results.append(getSegmentedText(FigureRecord(**fields)))
+        except Exception as e:
+            results.append(type(e).__name__)
+    with open(results_file, 'wb') as f_out:
+        pickle.dump(results, f_out)
+
+def checkParity(input_files: list, reference: str, synthetic: int) -> bool:
+    '''
+    Checks that getSegmentedText gives the same results as at the git
+    revision reference, on every figure of the articles and on synthetic
+    captions. Each version runs in its own interpreter. Prints the figures
+    that differ, and returns whether there were none.
+    '''
+    from functions.streamFunctions import iterFigureRecords
+    articles = findArticles(input_files)
+    records = [(os.path.basename(article), record) for article in articles for record in iterFigureRecords(article)]
+    records += [('synthetic', record) for record in syntheticRecords(synthetic)]
+    repository = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference_tree = os.path.join(tmp_dir, 'reference')
+        os.makedirs(reference_tree)
+        archive = subprocess.run(['git', '-C', repository, 'archive', reference, 'functions'],
+                                 check=True, capture_output=True).stdout
+        subprocess.run(['tar', '-x', '-C', reference_tree], input=archive, check=True)
+        records_file = os.path.join(tmp_dir, 'records.pickle')
+        with open(records_file, 'wb') as f_out:
+            pickle.dump([{field: getattr(record, field) for field in RECORD_FIELDS} for _, record in records], f_out)
+        results = []
+        for tree in [reference_tree, repository]:
+            results_file = os.path.join(tmp_dir, 'results.pickle')
+            subprocess.run([sys.executable, os.path.abspath(__file__), 'parity-child', tree, records_file, results_file],
+                           check=True)
+            with open(results_file, 'rb') as f_in:
+                results.append(pickle.load(f_in))
+    differences = [(source, record, expected, result) for (source, record), expected, result in zip(records, *results)
+                   if expected != result]
+    print('{} figures of {} articles and {} synthetic captions: {} differ from {}'.format(
+        len(records) - synthetic, len(articles), synthetic, len(differences), reference))
+    for source, record, expected, result in differences[:10]:
+        print('{} {}: {!r}\n  {}: {!r}\n  current: {!r}'.format(source, record.label, record.caption_text[:200],
+                                                               reference, expected, result))
+    return not differences
+
+def specimenCaption(specimens: int, rng) -> str:
+    '''Returns the caption of a herbarium specimen figure listing the given number of specimens'''
+    parts = ['Herbarium specimens of Solanum sp. ']
+    for i in range(specimens):
+        collector = rng.choice(COLLECTORS)
+        parts.append('{}. {}, Peru, {} {} (K, acc. no. {}). '.format(
+            chr(ord('A') + i % 26), rng.choice(['Holotype', 'Paratype', 'Isotype']), collector,
+            rng.randrange(10, 9999), rng.randrange(1000, 99999)))
+    parts.append('Photograph credits: B. J. Smith.')
+    return ''.join(parts)
+
+def benchmarkSplit(specimen_counts: list, repeat: int) -> None:
+    '''Times splitIgnoreCapital, the sentence splitter of herbarium specimen captions, on ever longer captions'''
+    from functions.figureFunctions import splitIgnoreCapital
+    rng = random.Random(0)
+    rows = []
+    for specimens in specimen_counts:
+        caption = specimenCaption(specimens, rng)
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            sentences = splitIgnoreCapital(caption, '. ')
+            runs.append(time.perf_counter() - start)
+        rows.append([specimens, len(caption), len(sentences), '{:.6f}'.format(min(runs))])
+    printTable(rows, ['Specimens', 'Characters', 'Sentences', 'Seconds'])
+
+def syntheticSegments(count: int, rng, distinct: bool = False) -> list:
+    '''
+    Returns count random caption attributes (descriptions, collections and
+    heights), each of them different from the others if distinct
+    '''
+    segments = []
+    for i in range(count):
+        kind = rng.randrange(4)
+        if kind == 0:
+            segment = ' {} '.format(rng.choice(PARTS))
+        elif kind == 1:
+            segment = '{} {}'.format(rng.choice(COLLECTORS), rng.randrange(10, 9999))
+        elif kind == 2:
+            segment = '{}.{} {}m'.format(rng.randrange(1, 50), rng.randrange(10), rng.choice('cm'))
+        else:
+            segment = ' Herbarium specimen of Solanum sp{}'.format(rng.randrange(1000))
+        segments.append(segment + ' #{}'.format(i) if distinct else segment)
+    return segments
+
+def benchmarkSegments(count: int, repeat: int) -> None:
+    '''Times the classification of count caption attributes one by one and all at once'''
+    import numpy as np
+    import pandas as pd
+    from functions.pandasFunctions import text2Index, text2Indexes
+    from functions.patternFunctions import DESCRIPTION_TEXT, HEIGHT_TEXT, HERBARIUM_SPECIMEN_TEXT
+
+    def strMatch(texts):
+        # The rules applied with pandas string methods, which still call re.match per text
+        texts = pd.Series(texts, dtype=object)
+        description = texts.str.match(DESCRIPTION_TEXT.pattern) | texts.str.match(HERBARIUM_SPECIMEN_TEXT.pattern)
+        return np.where(description, 0, np.where(texts.str.match(HEIGHT_TEXT.pattern), 2, 1))
+
+    classifiers = [('text2Index per segment', lambda texts: np.array([text2Index(text) for text in texts])),
+                   ('Series.str.match', strMatch),
+                   ('text2Indexes', text2Indexes)]
+    rows = []
+    for distinct in (False, True):
+        texts = syntheticSegments(count, random.Random(0), distinct)
+        expected = None
+        for name, classify in classifiers:
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                indexes = classify(texts)
+                runs.append(time.perf_counter() - start)
+            expected = indexes if expected is None else expected
+            rows.append([name, 'yes' if distinct else 'no', '{:.3f}'.format(min(runs)),
+                         'yes' if np.array_equal(indexes, expected) else 'NO'])
+    printTable(rows, ['{} segments'.format(count), 'All distinct', 'Seconds', 'Identical'])
+
+def syntheticFigures(segments: int):
+    '''
+    Returns an iterator of FigureRecords with random captions, that the
+    parser can segment, until their segments add up to at least segments.
+    The records reuse the captions of a pool of 2000, built beforehand, so
+    that creating them costs next to nothing.
+    '''
+    from functions.figureFunctions import FigureRecord, getSegmentedText
+    pool = []
+    for record in syntheticRecords(2000):
+        try:
+            pool.append((record, len(getSegmentedText(record)[0])))
+        except (IndexError, ValueError):
+            pass
+
+    def figures():
+        total = 0
+        i = 0
+        while total < segments:
+            record, panels = pool[i % len(pool)]
+            i += 1
+            total += panels
+            yield FigureRecord(label='Figure {}'.format(i), taxon_name=record.taxon_name,
+                               description=record.description, section=record.section,
+                               caption_text=record.caption_text, url=record.url, text=record.text,
+                               strings=record.strings, bolds=record.bolds)
+    return figures()
+
+def concatenatedDataFrame(figures: list):
+    '''figures2DataFrame as it was built before: one array per figure, all concatenated at the end'''
+    import numpy as np
+    import pandas as pd
+    from functions.pandasFunctions import DATAFRAME_COLUMNS, INDEX_NAMES, figureInfo2MultiIndex, iterFigureRows
+    specific_data = []
+    multi_indexes = []
+    for figure_id, (figure_info, _, rows) in enumerate(iterFigureRows(figures), 1):
+        specific_data.append(rows)
+        multi_indexes.append(figureInfo2MultiIndex(figure_info, figure_id))
+    index = pd.MultiIndex.from_arrays(np.concatenate(multi_indexes, axis=0).T, names=INDEX_NAMES)
+    return pd.DataFrame(data=np.concatenate(specific_data, axis=0), index=index, columns=DATAFRAME_COLUMNS)
+
+# Ways of building the DataFrame of the figures compared by benchmarkDataFrame
+DATAFRAME_BUILDERS = ['concatenate', 'columnar', 'batches']
+
+def dataFrameChild(segments: int, builder: str) -> None:
+    from functions.pandasFunctions import figures2DataFrame, figures2DataFrames
+    figures = syntheticFigures(segments)
+    if builder != 'batches':
+        figures = list(figures)
+    start = time.perf_counter()
+    if builder == 'concatenate':
+        rows = len(concatenatedDataFrame(figures))
+    elif builder == 'columnar':
+        rows = len(figures2DataFrame(figures))
+    else:
+        # Each batch is dropped once built, as it would be once written out
+        rows = sum(len(batch) for batch in figures2DataFrames(figures))
+    print(json.dumps({'seconds': time.perf_counter() - start, 'peak_rss': peakRss(), 'rows': rows}))
+
+def benchmarkDataFrame(segment_counts: list) -> None:
+    '''
+    Times figures2DataFrame against the former concatenating builder and
+    against figures2DataFrames batches, on ever more segments (DataFrame rows),
+    with the peak RSS of each run
+    '''
+    rows = []
+    for segments in segment_counts:
+        for builder in DATAFRAME_BUILDERS:
+            run = runChild('dataframe-child', str(segments), builder)
+            rows.append([run['rows'], builder, '{:.3f}'.format(run['seconds']), '{:.1f}'.format(run['peak_rss'] / 2 ** 20)])
+    printTable(rows, ['Segments', 'Builder', 'Seconds', 'Peak RSS (MB)'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages of the pipeline.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    xml_parser = subparsers.add_parser('xml', help="Figure extraction with each backend")
+    xml_parser.add_argument("input_files", nargs='+', help="Paths to XML format articles, or directories of them")
+    xml_parser.add_argument("--repeat", type=int, default=3, help="Runs per mode, the fastest is reported")
+
+    backends_parser = subparsers.add_parser('backends', help="Figure accessors of the BeautifulSoup vs lxml backends")
+    backends_parser.add_argument("input_files", nargs='+', help="Paths to XML format articles, or directories of them")
+
+    corpus_parser = subparsers.add_parser('corpus', help="One process per article vs corpus mode")
+    corpus_parser.add_argument("download_prefix", help="Directory of downloaded XML format articles")
+    corpus_parser.add_argument("--processes", type=int, help="Worker processes in corpus mode (default: one per core)")
+
+    articles_parser = subparsers.add_parser('articles', help="Reading plain vs gzip compressed articles, cold and warm")
+    articles_parser.add_argument("input_files", nargs='+', help="Paths to XML format articles, or directories of them")
+    articles_parser.add_argument("--backend", choices=['soup', 'lxml', 'streaming'], default='streaming')
+    articles_parser.add_argument("--repeat", type=int, default=3, help="Runs per storage and cache state, the fastest is reported")
+
+    fetch_parser = subparsers.add_parser('fetch', help="Batch download from a local stand-in HTTP server, cold and warm")
+    fetch_parser.add_argument("input_files", nargs='*',
+                              help="XML format articles, or directories of them, to serve (default: small synthetic ones)")
+    fetch_parser.add_argument("--count", type=int, default=200, help="Number of articles downloaded")
+    fetch_parser.add_argument("--workers", type=int, nargs='+', default=[1, 8], help="Numbers of download threads")
+    fetch_parser.add_argument("--latency", type=float, default=0.02, help="Seconds the stand-in server waits per request")
+
+    captions_parser = subparsers.add_parser('captions', help="Caption parsing on synthetic captions")
+    captions_parser.add_argument("--count", type=int, default=100000, help="Number of synthetic captions")
+    captions_parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest is reported")
+
+    parity_parser = subparsers.add_parser('parity', help="Caption segmentation of the working tree vs a git revision")
+    parity_parser.add_argument("input_files", nargs='*', help="Paths to XML format articles, or directories of them")
+    parity_parser.add_argument("--reference", default='HEAD', help="Git revision whose getSegmentedText is the reference")
+    parity_parser.add_argument("--synthetic", type=int, default=10000, help="Number of synthetic captions checked too")
+
+    split_parser = subparsers.add_parser('split', help="Sentence splitting of long herbarium specimen captions")
+    split_parser.add_argument("--specimens", type=int, nargs='+', default=[10, 100, 1000, 10000],
+                              help="Numbers of specimens listed in the captions")
+    split_parser.add_argument("--repeat", type=int, default=5, help="Runs per caption, the fastest is reported")
+
+    segments_parser = subparsers.add_parser('segments', help="Classification of caption attributes, one by one vs all at once")
+    segments_parser.add_argument("--count", type=int, default=1000000, help="Number of synthetic attributes")
+    segments_parser.add_argument("--repeat", type=int, default=3, help="Runs per classifier, the fastest is reported")
+
+    dataframe_parser = subparsers.add_parser('dataframe', help="Building the DataFrame of ever more segments")
+    dataframe_parser.add_argument("--segments", type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                                  help="Numbers of segments (DataFrame rows)")
+
+    # Used internally to measure a single run in a fresh interpreter
+    xml_child_parser = subparsers.add_parser('xml-child')
+    xml_child_parser.add_argument("input_file")
+    xml_child_parser.add_argument("output_file")
+    xml_child_parser.add_argument("mode", choices=['soup', 'lxml', 'streaming'])
+    articles_child_parser = subparsers.add_parser('articles-child')
+    articles_child_parser.add_argument("article_dir")
+    articles_child_parser.add_argument("backend", choices=['soup', 'lxml', 'streaming'])
+    articles_child_parser.add_argument("cache", choices=['cold', 'warm'])
+    parity_child_parser = subparsers.add_parser('parity-child')
+    parity_child_parser.add_argument("tree")
+    parity_child_parser.add_argument("records_file")
+    parity_child_parser.add_argument("results_file")
+    dataframe_child_parser = subparsers.add_parser('dataframe-child')
+    dataframe_child_parser.add_argument("segments", type=int)
+    dataframe_child_parser.add_argument("builder", choices=DATAFRAME_BUILDERS)
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'xml':
+        benchmarkXml(args.input_files, args.repeat)
+    elif args.benchmark == 'backends':
+        if not benchmarkBackends(args.input_files):
+            raise SystemExit('The backends do not give identical results')
+    elif args.benchmark == 'corpus':
+        benchmarkCorpus(args.download_prefix, args.processes)
+    elif args.benchmark == 'articles':
+        benchmarkArticles(args.input_files, args.backend, args.repeat)
+    elif args.benchmark == 'fetch':
+        if not benchmarkFetch(args.input_files, args.count, args.workers, args.latency):
+            raise SystemExit('The downloads from the stand-in server did not pass the checks')
+    elif args.benchmark == 'captions':
+        benchmarkCaptions(args.count, args.repeat)
+    elif args.benchmark == 'parity':
+        if not checkParity(args.input_files, args.reference, args.synthetic):
+            raise SystemExit('getSegmentedText does not give the same results as {}'.format(args.reference))
+    elif args.benchmark == 'split':
+        benchmarkSplit(args.specimens, args.repeat)
+    elif args.benchmark == 'segments':
+        benchmarkSegments(args.count, args.repeat)
+    elif args.benchmark == 'dataframe':
+        benchmarkDataFrame(args.segments)
+    elif args.benchmark == 'xml-child':
+        xmlChild(args.input_file, args.output_file, args.mode)
+    elif args.benchmark == 'articles-child':
+        articlesChild(args.article_dir, args.backend, args.cache)
+    elif args.benchmark == 'parity-child':
+        parityChild(args.tree, args.records_file, args.results_file)
+    elif args.benchmark == 'dataframe-child':
+        dataFrameChild(args.segments, args.builder)
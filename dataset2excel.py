@@ -0,0 +1,19 @@
+import argparse
+
+from functions.datasetFunctions import DATASET_FORMATS, dataset2Excel
+
+if __name__ == "__main__":
+
+    # Create an ArgumentParser object
+    parser = argparse.ArgumentParser(description="Export (part of) a Parquet/Feather dataset of figures to excel.")
+
+    # Add the command-line arguments
+    parser.add_argument("dataset_dir", help="Path to the dataset written by illustrations2captions.py --dataset_dir")
+    parser.add_argument("output_file", help="Path to the output excel file")
+    parser.add_argument("--dois", nargs='+', help="Articles to export (default: all)")
+    parser.add_argument("--columns", nargs='+', help="Columns to export (default: all)")
+    parser.add_argument("--format", default='parquet', choices=list(DATASET_FORMATS))
+    # Parse the command-line arguments
+    args = parser.parse_args()
+
+    dataset2Excel(args.dataset_dir, args.output_file, args.dois, args.columns, args.format)
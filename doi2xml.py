@@ -1,23 +1,63 @@
 import argparse
 import os.path
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin
+
 import requests
 
+from functions.compressionFunctions import COMPRESSED_SUFFIX, writeArticle
+from functions.httpFunctions import HTTP_CACHE_DIR, REQUESTS_PER_SECOND, HttpCache, configureArchive, \
+    configureScheduler, createSession
+
+DOI_RESOLVER = 'https://doi.org/'
+ARTICLE_XML_URL = 'https://phytokeys.pensoft.net/article/{article_id}/download/xml/'
+DOI_INDEX = '.cache/doi-index.sqlite'
 
-def doi2xml(doi, output_file):
-    # Get actual url 
-    r = requests.get('https://doi.org/' + doi)
-    url = r.url
-    # Get article ID:
-    article_id = phytokeysurl2articleid(url)
+
+def doi2xml(doi, output_file, session=None, resolver=DOI_RESOLVER, xml_url=ARTICLE_XML_URL, doi_index=None,
+            cache=None):
+    '''Downloads the XML format article of doi to output_file, gzip compressed if output_file ends with .gz'''
+    if session is None:
+        session = createSession(pool_size=1)
+    # Get article ID, from the index if this DOI has been resolved before
+    article_id = doi_index.get(doi) if doi_index is not None else None
+    if article_id is None:
+        article_id = resolveDoi(doi, session, resolver)
+        if doi_index is not None:
+            doi_index.put(doi, article_id)
     # Get XML
-    url = 'https://phytokeys.pensoft.net/article/{article_id}/download/xml/'.format(article_id=article_id)
-    r = requests.get(url)
+    url = xml_url.format(article_id=article_id)
+    if cache is not None:
+        # Only downloaded if it changed since it was cached, and written compressed if output_file ends with .gz
+        cache.fetch(session, url, output_file)
+        return
+    r = session.get(url)
+    r.raise_for_status()
     # Save to file
-    with open(output_file, 'w', encoding='utf8') as f_out:
-        f_out.write(r.text)
-    
+    writeArticle(output_file, r.text)
+
+def resolveDoi(doi, session, resolver=DOI_RESOLVER, max_redirects=5) -> str:
+    '''
+    Returns the article id that the DOI resolves to. Only the Location
+    headers of the redirects are read (HEAD requests, redirects not followed),
+    so the article landing page itself is never downloaded.
+    '''
+    url = resolver + doi
+    for _ in range(max_redirects):
+        r = session.head(url, allow_redirects=False)
+        if not r.is_redirect:
+            r.raise_for_status()
+            break
+        url = urljoin(url, r.headers['Location'])
+        article_id = phytokeysurl2articleid(url)
+        if article_id:
+            return article_id
+    raise ValueError('Could not resolve {} to a PhytoKeys article id (last url: {})'.format(doi, url))
+
 def phytokeysurl2articleid(url):
-    articleid = None
+    article_id = None
     if url is not None:
         if '?id=' in url:
             article_id = url.split('?id=',1)[-1]
@@ -27,17 +67,135 @@ def phytokeysurl2articleid(url):
                 article_id = article_id[:-1]
     return article_id
 
+class DoiIndex:
+    '''
+    Persistent DOI -> article id lookup table, stored in SQLite so that
+    repeat runs (and concurrent make jobs) skip the doi.org resolution.
+    The instance can be shared between the threads of a batch download.
+    '''
+    def __init__(self, path: str = DOI_INDEX):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS doi_index '
+                                    '(doi TEXT PRIMARY KEY, article_id TEXT NOT NULL)')
+
+    def get(self, doi: str) -> str:
+        '''Returns the cached article id of doi, or None if it has not been resolved yet'''
+        with self.lock:
+            row = self.connection.execute('SELECT article_id FROM doi_index WHERE doi = ?', (doi,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, doi: str, article_id: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO doi_index VALUES (?, ?)', (doi, article_id))
+
+    def close(self) -> None:
+        self.connection.close()
+
+def readDois(doi_file: str) -> list:
+    '''Returns the DOIs listed one per line in doi_file, skipping blank lines'''
+    with open(doi_file, 'r', encoding='utf8') as f_in:
+        return [line.strip() for line in f_in if line.strip()]
+
+def doi2path(doi: str, download_prefix: str, compressed: bool = True) -> str:
+    '''
+    Returns the download path used by the Makefile for a DOI
+    Example: 10.3897/phytokeys.22.4041 -> downloads/10.3897/phytokeys.22.4041.xml.gz
+    (downloads/10.3897/phytokeys.22.4041.xml if not compressed, or if it
+    was downloaded uncompressed before and not since)
+    '''
+    path = os.path.join(download_prefix, doi + '.xml')
+    if (compressed and not os.path.exists(path)) or os.path.exists(path + COMPRESSED_SUFFIX):
+        path += COMPRESSED_SUFFIX
+    return path
+
+def dois2xml(dois: list, download_prefix: str, workers: int = 8, resolver=DOI_RESOLVER,
+             xml_url=ARTICLE_XML_URL, doi_index=None, cache=None, compressed: bool = True) -> dict:
+    '''
+    Downloads the XML format article for every DOI in dois into download_prefix,
+    using a bounded pool of worker threads that share one keep-alive session.
+    The articles are stored gzip compressed unless compressed is False.
+    DOIs whose output file already exists are skipped, as make would do.
+    Returns a dictionary of DOI -> error for the downloads that failed,
+    whether the error was an HTTP one or a local one (file system, DOI index).
+    '''
+    session = createSession(pool_size=workers)
+    failures = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for doi in dois:
+            output_file = doi2path(doi, download_prefix, compressed)
+            if os.path.exists(output_file):
+                continue
+            try:
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            except OSError as e:
+                failures[doi] = e
+                print('Failed to download {}: {}'.format(doi, e))
+                continue
+            future = executor.submit(doi2xml, doi, output_file, session, resolver, xml_url, doi_index, cache)
+            futures[future] = doi
+
+        for future in as_completed(futures):
+            doi = futures[future]
+            try:
+                future.result()
+            # A local error (eg disk full, or the DOI index) only fails that DOI, not the rest of the batch
+            except (requests.RequestException, ValueError, OSError, sqlite3.Error) as e:
+                failures[doi] = e
+                print('Failed to download {}: {}'.format(doi, e))
+
+    session.close()
+    return failures
+
 
 if __name__ == "__main__":
     # Create an ArgumentParser object
     parser = argparse.ArgumentParser(description="Process DOI and save XML format article in output file.")
 
     # Add the command-line arguments
-    parser.add_argument("doi", help="Phytokeys DOI to be downloaded")
-    parser.add_argument("output_file", help="Path to the output file")
+    parser.add_argument("doi", nargs='?', help="Phytokeys DOI to be downloaded")
+    parser.add_argument("output_file", nargs='?', help="Path to the output file")
+    # Batch mode: download many DOIs at once instead of one per process
+    parser.add_argument("--doi_file", help="Path to a file listing one DOI per line (batch mode)")
+    parser.add_argument("--dois", nargs='+', help="List of DOIs to be downloaded (batch mode)")
+    parser.add_argument("--download_prefix", default='downloads/', help="Directory used to store batch downloads")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent downloads in batch mode")
+    parser.add_argument("--uncompressed", dest='compressed', default=True, action='store_false',
+                        help="Store the articles downloaded in batch mode as plain .xml rather than .xml.gz")
+    parser.add_argument("--doi_index", default=DOI_INDEX, help="Path to the DOI -> article id resolution cache")
+    parser.add_argument("--cache_dir", default=HTTP_CACHE_DIR, help="Directory of the HTTP cache ('' to disable)")
+    parser.add_argument("--requests_per_second", type=float, default=REQUESTS_PER_SECOND, help="Request rate limit per host")
+    parser.add_argument("--http_archive", help="Path to an HTTP archive to record responses to, or replay them from")
+    parser.add_argument("--archive_mode", choices=['record', 'replay'], default='record',
+                        help="Record responses to the HTTP archive, or replay them without network access")
 
     # Parse the command-line arguments
     args = parser.parse_args()
 
-    # Call the main function with the provided arguments
-    doi2xml(args.doi, args.output_file)
+    if not (args.doi_file or args.dois or (args.doi and args.output_file)):
+        parser.error('either doi and output_file, or --doi_file/--dois must be given')
+
+    configureScheduler(rate=args.requests_per_second)
+    if args.http_archive:
+        configureArchive(args.http_archive, args.archive_mode)
+    # When recording, always resolve so that the resolution is in the archive too
+    recording = args.http_archive and args.archive_mode == 'record'
+    doi_index = DoiIndex(args.doi_index if not recording else ':memory:')
+    # The articles are kept compressed in the cache too
+    cache = HttpCache(os.path.join(args.cache_dir, 'xml'), compressed=True) if args.cache_dir else None
+    if args.doi_file or args.dois:
+        dois = args.dois if args.dois else readDois(args.doi_file)
+        failures = dois2xml(dois, args.download_prefix, args.workers, doi_index=doi_index, cache=cache,
+                            compressed=args.compressed)
+        doi_index.close()
+        if failures:
+            raise SystemExit(1)
+    else:
+        # Call the main function with the provided arguments
+        doi2xml(args.doi, args.output_file, doi_index=doi_index, cache=cache)
+        doi_index.close()
@@ -0,0 +1,130 @@
+import builtins
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import functions.figureFunctions as figureFunctions
+import functions.helperFunctions as helperFunctions
+import functions.patternFunctions as patternFunctions
+
+CAPTION_CACHE = '.cache/captions.sqlite'
+
+def parserVersion() -> str:
+    '''
+    Returns a hash of the source code of the caption parser, so that
+    results cached by an earlier version of the parser are not used
+    '''
+    hasher = hashlib.sha256()
+    for module in (figureFunctions, helperFunctions, patternFunctions):
+        with open(module.__file__, 'rb') as f_in:
+            hasher.update(f_in.read())
+    return hasher.hexdigest()
+
+def cacheStatistics(hits: int, misses: int) -> str:
+    lookups = hits + misses
+    return 'Caption cache: {} hits, {} misses ({:.0%} hit rate)'.format(hits, misses, hits / lookups if lookups else 0.0)
+
+class CaptionCache:
+    '''
+    Persistent store of getSegmentedText results, stored in SQLite, so that
+    reruns only parse the captions which are new or changed. Results are
+    keyed by a hash of everything getSegmentedText reads from the figure
+    (its caption strings, bold labels and taxon name) and of the parser
+    version. Captions the parser fails on are stored too, with the
+    exception to raise again, as long as it is a built-in one.
+    New results are written in batches of batch_size.
+    The instance can be shared between threads.
+    '''
+    def __init__(self, path: str = CAPTION_CACHE, version: str = None, batch_size: int = 1000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.version = (version if version is not None else parserVersion()).encode('utf8')
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        # Key -> result looked up by prefetch and not used yet, None if not cached
+        self.prefetched = {}
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Write-ahead logging lets processes read while another writes, and syncs less often
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS captions (key BLOB PRIMARY KEY, result TEXT NOT NULL) WITHOUT ROWID')
+
+    def key(self, figure) -> bytes:
+        '''Returns the cache key of a FigureRecord'''
+        # Control characters cannot occur in XML text, so they separate the fields unambiguously
+        content = '\x1f'.join(['\x1d' if figure.taxon_name is None else figure.taxon_name,
+                               '\x1e'.join(figure.strings), '\x1e'.join(figure.bolds)])
+        return hashlib.sha256(self.version + content.encode('utf8')).digest()
+
+    def prefetch(self, figures: list) -> None:
+        '''Looks up the results of many figures at once, which is much faster than one by one'''
+        keys = [self.key(figure) for figure in figures if figure is not None]
+        with self.lock:
+            self.prefetched.update(dict.fromkeys(keys))
+            # SQLite allows at most 999 parameters per statement in older versions
+            for i in range(0, len(keys), 999):
+                batch = keys[i:i + 999]
+                query = 'SELECT key, result FROM captions WHERE key IN ({})'.format(','.join('?' * len(batch)))
+                self.prefetched.update(self.connection.execute(query, batch).fetchall())
+
+    def getSegmentedText(self, figure) -> (dict, list):
+        '''Returns figureFunctions.getSegmentedText(figure), from the cache if the caption was parsed before'''
+        if figure is None:
+            return figureFunctions.getSegmentedText(figure)
+        key = self.key(figure)
+        with self.lock:
+            result = self.pending.get(key)
+            if key in self.prefetched:
+                result = self.prefetched.pop(key) or result
+            elif result is None:
+                row = self.connection.execute('SELECT result FROM captions WHERE key = ?', (key,)).fetchone()
+                result = row[0] if row is not None else None
+            if result is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if result is not None:
+            result = json.loads(result)
+            if isinstance(result, dict):
+                raise getattr(builtins, result['error'])(*result['args'])
+            figure_info, photo_source = result
+            return figure_info, photo_source
+
+        try:
+            result = figureFunctions.getSegmentedText(figure)
+        except Exception as e:
+            if getattr(builtins, type(e).__name__, None) is type(e):
+                self.store(key, json.dumps({'error': type(e).__name__, 'args': e.args}, ensure_ascii=False))
+            raise
+        self.store(key, json.dumps(result, ensure_ascii=False))
+        return result
+
+    def store(self, key: bytes, result: str) -> None:
+        with self.lock:
+            self.pending[key] = result
+            if len(self.pending) >= self.batch_size:
+                self.flushPending()
+
+    def flushPending(self) -> None:
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO captions VALUES (?, ?)', self.pending.items())
+        self.pending = {}
+
+    def flush(self) -> None:
+        '''Writes the results not stored yet'''
+        with self.lock:
+            self.flushPending()
+
+    def statistics(self) -> str:
+        with self.lock:
+            return cacheStatistics(self.hits, self.misses)
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
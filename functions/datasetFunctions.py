@@ -0,0 +1,85 @@
+import os
+from urllib.parse import quote
+
+from functions.pandasFunctions import BATCH_ROWS, DATAFRAME_COLUMNS, INDEX_NAMES, figures2DataFrames
+
+# Column of the dataset holding the DOI of the article, ie its partition
+PARTITION_COLUMN = 'doi'
+# File format -> file name extension
+DATASET_FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+DATASET_COMPRESSION = 'zstd'
+
+def importArrow():
+    '''pyarrow is only needed to write and read datasets, so it is imported on demand'''
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError('Parquet/Feather datasets need pyarrow: pip install pyarrow') from e
+    return pyarrow
+
+def datasetSchema():
+    '''Schema of the dataset: the index and columns of figures2DataFrame, all of them strings'''
+    pa = importArrow()
+    return pa.schema([(name, pa.string()) for name in INDEX_NAMES + DATAFRAME_COLUMNS])
+
+def partitionPath(dataset_dir: str, doi: str, file_format: str = 'parquet') -> str:
+    '''
+    Returns the file holding the figures of the article with doi, in a
+    (Hive style) directory of its own, eg dataset/doi=10.3897%2Fphytokeys.22.4041/part-0.parquet
+    '''
+    partition = '{}={}'.format(PARTITION_COLUMN, quote(doi, safe=''))
+    return os.path.join(dataset_dir, partition, 'part-0' + DATASET_FORMATS[file_format])
+
+def figures2Dataset(figures, dataset_dir: str, doi: str, cache=None, file_format: str = 'parquet',
+                    compression: str = DATASET_COMPRESSION, batch_rows: int = BATCH_ROWS,
+                    skip_unsegmented: bool = False, article_id: int = 0) -> int:
+    '''
+    Writes the DataFrame of pandasFunctions.figures2DataFrame for the figures
+    (any iterable) of the article with doi to its partition of the dataset in
+    dataset_dir, as compressed Parquet (or Feather) with column statistics,
+    so that readers can skip the columns and articles they do not need.
+    The rows are written batch by batch (one Parquet row group per batch),
+    so memory use does not grow with the number of figures.
+    The partition replaces any former one once complete. Returns the number of rows.
+    If skip_unsegmented, figures whose caption cannot be segmented are left out.
+    article_id is that of the article, see pandasFunctions.iterFigureRows.
+    '''
+    pa = importArrow()
+    schema = datasetSchema()
+    path = partitionPath(dataset_dir, doi, file_format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Readers skip files starting with '.', so the partition is not read before it is complete
+    part_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path))
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(part_path, schema, compression=compression, write_statistics=True)
+    else:
+        writer = pa.ipc.new_file(part_path, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+    rows = 0
+    with writer:
+        for batch in figures2DataFrames(figures, batch_rows, cache, skip_unsegmented, article_id):
+            table = pa.Table.from_pandas(batch.reset_index(), schema=schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(batch)
+    os.replace(part_path, path)
+    return rows
+
+def readDataset(dataset_dir: str, dois: list = None, columns: list = None, file_format: str = 'parquet'):
+    '''
+    Returns the dataset written by figures2Dataset as a DataFrame, reading
+    only the given columns of the articles with the given DOIs (all if None)
+    '''
+    importArrow()
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(dataset_dir, format='ipc' if file_format == 'feather' else file_format,
+                         partitioning='hive')
+    condition = ds.field(PARTITION_COLUMN).isin(dois) if dois else None
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+def dataset2Excel(dataset_dir: str, output_file: str, dois: list = None, columns: list = None,
+                  file_format: str = 'parquet') -> None:
+    '''Writes (part of) the dataset to an excel file, like pandasFunctions.df2Excel'''
+    df = readDataset(dataset_dir, dois, columns, file_format)
+    index = [name for name in [PARTITION_COLUMN] + INDEX_NAMES if name in df.columns]
+    df.set_index(index).to_excel(output_file, index=True)
@@ -1,10 +1,40 @@
-import re
-
 # import sys
 # functions_path = 'C:/Users/eka10kg/OneDrive - The Royal Botanic Gardens, Kew/functions'
 # if functions_path not in sys.path:
 #     sys.path.append(functions_path)
 from functions.helperFunctions import customLetterCount, customLoopCount, standartdizeFigureInfo
+from functions.patternFunctions import END_LINES, ILLUSTRATION_COLLECTIONS, SCALE_BAR_LETTER, SPECIMEN_ACCESSION, \
+    SPECIMEN_COLLECTIONS
+
+class FigureRecord:
+    '''
+    Everything the pipeline reads from a <fig>, extracted once so that the
+    getters below do not walk the XML tree again for every caption string.
+    Built from a BeautifulSoup Tag by figure2Record, from an lxml element by
+    lxmlFunctions.figure2Record, or while streaming the article by
+    streamFunctions.iterFigureRecords. Fields that are missing from the XML
+    are None.
+    '''
+    __slots__ = ('label', 'taxon_name', 'description', 'section', 'caption_text', 'url', 'xml',
+                 'text', 'strings', 'bolds', 'end_line')
+
+    def __init__(self, label=None, taxon_name=None, description=None, section=None, caption_text=None,
+                 url=None, xml=None, text='', strings=(), bolds=()):
+        self.label = label
+        self.taxon_name = taxon_name
+        self.description = description
+        # Title of the section the figure is in, eg Description
+        self.section = section
+        self.caption_text = caption_text
+        self.url = url
+        # Markup of the whole <fig>
+        self.xml = xml
+        # Text of the first paragraph of the figure (its caption) and its strings in document order
+        self.text = text
+        self.strings = list(strings)
+        # Text of every bold element of the figure, ie the labels of its segments
+        self.bolds = list(bolds)
+        self.end_line = getEndLineCondition(text)
 
 def figureSegmentation(figures: list) -> dict:
     '''
@@ -14,7 +44,7 @@ def figureSegmentation(figures: list) -> dict:
     new_dict = {}
     
     for figure in figures:
-        key = figure.parent.title.text.replace('.', '')
+        key = getSection(figure)
         
         get_title = new_dict.get(key, [])
         get_title.append(figure)
@@ -23,14 +53,25 @@ def figureSegmentation(figures: list) -> dict:
     
     return new_dict
 
+def getSection(figure) -> str:
+    '''Returns the title of the section the figure is in, without full stops'''
+    title = figure.parent.title
+    return title.text.replace('.', '') if title is not None else None
+
 def getDescription(figure):
     '''Returns the description text for the figure from its parent object'''
-    description = ' '.join([e.text for e in figure.parent.find('p').contents])      
+    paragraph = figure.parent.find('p')
+    if paragraph is None:
+        return None
+    description = ' '.join([e.text for e in paragraph.contents])      
     return description
 
 def getTaxonName(figure):
     '''Returns the taxon name of the plant illustrated in the figure'''
-    taxon_name = figure.parent.parent.find('tp:nomenclature')
+    grandparent = figure.parent.parent
+    taxon_name = grandparent.find('tp:nomenclature') if grandparent is not None else None
+    if taxon_name is None or taxon_name.find('tp:taxon-name') is None:
+        return None
     taxon_name_texts = taxon_name.find('tp:taxon-name').find_all('tp:taxon-name-part')
     return ' '.join([txt.text for txt in taxon_name_texts])
 
@@ -39,39 +80,63 @@ def getLabel(figure) -> str:
     Returns the label of the figure.
     Example: out: Figure 1
     '''
+    if figure.label is None:
+        return None
     return figure.label.text.replace('.', '')
 
 def getCaptionText(figure) -> str:
     '''Returns the caption text of the figure'''
+    if figure.caption is None or figure.caption.p is None:
+        return None
     return ' '.join([content.text for content in figure.caption.p.contents])
 
 def getUrl(figure) -> str:
     '''Returns the url of the figure'''
+    if figure.uri is None:
+        return None
     return figure.uri.text
 
-def getLetterCount(figure) -> int:
+def getParagraphText(figure) -> str:
+    '''Returns the text of the first paragraph of the figure, ie its caption'''
+    return figure.p.text if figure.p is not None else ''
+
+def getStrings(figure) -> list:
+    '''Returns the strings of the first paragraph of the figure in document order'''
+    return list(figure.p.strings) if figure.p is not None else []
+
+def getBolds(figure) -> list:
+    '''Returns the text of every bold element of the figure'''
+    return [bold.text for bold in figure.find_all('bold')]
+
+# Field of FigureRecord -> function extracting it from a BeautifulSoup <fig> Tag
+# (functions.lxmlFunctions has the same for lxml elements)
+ACCESSORS = {'label': getLabel, 'taxon_name': getTaxonName, 'description': getDescription, 'section': getSection,
+             'caption_text': getCaptionText, 'url': getUrl, 'xml': str, 'text': getParagraphText,
+             'strings': getStrings, 'bolds': getBolds}
+
+def figure2Record(figure) -> FigureRecord:
+    '''Returns the FigureRecord of a BeautifulSoup <fig> Tag'''
+    return FigureRecord(**{field: accessor(figure) for field, accessor in ACCESSORS.items()})
+
+def getLetterCount(figure: FigureRecord) -> int:
     '''
     Returns the bold letter count of the figure.
     This is equavilent to how many segments an illustration os divided into.
     If there are no bold labels, the illustration has only one segment.
     '''
-    bolds = figure.find_all('bold')
-    
-    if not bolds:
+    if not figure.bolds:
         return 1
     
-    return customLetterCount([bold.text for bold in bolds])
+    return customLetterCount(figure.bolds)
 
-def getLoopBoldCount(figure) -> int:
+def getLoopBoldCount(figure: FigureRecord) -> int:
     '''Returns how many times the bold labels loop in a caption of the figure.'''
-    bolds = figure.find_all('bold')
-    
-    if not bolds:
+    if not figure.bolds:
         return 0
     
-    return customLoopCount('A', [bold.text for bold in bolds])
+    return customLoopCount('A', figure.bolds)
 
-def getSegmentedText(figure, taxon_name: str) -> (dict, list):
+def getSegmentedText(figure: FigureRecord) -> (dict, list):
     '''
     Returns a dictionary/map of [BOLD_LETTER] -> [Attributes]
     if there are no BOLD_LETTERS, returns dictionary of 
@@ -81,34 +146,43 @@ def getSegmentedText(figure, taxon_name: str) -> (dict, list):
     if figure is None:
         return {}, []
     
-    bolds = [bold.text for bold in figure.find_all('bold')]
+    bolds = list(figure.bolds)
     if len(bolds) < 1:
-        no_bold_list = getTextFromNoBold(figure, taxon_name)
+        no_bold_list = getTextFromNoBold(figure)
         if len(no_bold_list) == 1:
-            end_line = getEndLineCondition(figure)
-            return {'ALL': [no_bold_list[0]]}, [figure.p.text.split(end_line, 1)[-1]]
-        if '©' in figure.p.text and '©' not in no_bold_list[-1]:
-            return {'ALL': no_bold_list}, [figure.p.text.split('©')[-1]]
+            return {'ALL': [no_bold_list[0]]}, [figure.text.split(figure.end_line, 1)[-1]]
+        if '©' in figure.text and '©' not in no_bold_list[-1]:
+            return {'ALL': no_bold_list}, [figure.text.split('©')[-1]]
         return {'ALL': no_bold_list[:-1]}, [no_bold_list[-1]]
 
         
-    texts = []
-    current_text = ''
-    add_to_text = False
-    is_end_text = False
-    general_to_text = False
-    first_time_after_end = False
-    end_line = getEndLineCondition(figure)
-    
-    generalTexts = []
-    do_not_add = False
     # A system to go from 'A <<text1A>> B <<text1B>> A <<text2A>> B <<text2B>>' 
     # to {A: [text1A, text2A], B: [text1B, text2B]} 
-    for line in figure.p.strings:
+    texts, generalTexts = parseCaptionTokens(tokenizeCaption(figure))
+    return standartdizeFigureInfo(bolds, texts), generalTexts
+
+# Kinds of the tokens of a caption, see tokenizeCaption
+LABEL, TEXT, SCALE_BAR, END_LINE = range(4)
+
+def tokenizeCaption(figure: FigureRecord):
+    '''
+    Reads the strings of the caption of the figure in a single pass and
+    yields them as (kind, text) tokens:
+    LABEL - a bold panel label, eg A
+    TEXT - text of a panel, or of the photo source after the end line
+    SCALE_BAR - height data labelled [DATA] ([BOLD_LETTER]), text is the data
+    END_LINE - a string containing the end line, text is (before, after) it
+    '''
+    taxon_name = figure.taxon_name if figure.taxon_name is not None else ''
+    bolds = set(figure.bolds)
+    end_line = figure.end_line
+    # Whether the caption labels height data as [BOLD_LETTER] = [DATA], only looked up if needed
+    letter_scale_bars = None
+    
+    for line in figure.strings:
         
         # Error in xml
         if line in taxon_name:
-            # print(line)
             continue
         
         # Check condition for differently labeled heaight data
@@ -117,76 +191,104 @@ def getSegmentedText(figure, taxon_name: str) -> (dict, list):
         # i.e. [BOLD LETTER] [DATA] repeat
         # The following code checks for the other format
         # i. e. [DATA] ([BOLD_LETTER])
-        if line.find('Scale bars: ') > -1:
-            texts.append(current_text)
-            new_text = line.split('Scale bars: ', 1)[-1]
-            texts.append(new_text)
-            do_not_add = True
-            current_text = ''
+        if 'Scale bars: ' in line:
+            yield SCALE_BAR, line.split('Scale bars: ', 1)[-1]
             continue
         
         # Check condition for differently labeled height data 2
-        if line.find('Scale bar:') > -1:
+        if 'Scale bar:' in line:
+            if letter_scale_bars is None:
+                letter_scale_bars = SCALE_BAR_LETTER.search(figure.text) is not None
             # Only continue if the format is similar to previous condition's format
-            if not re.findall('[A-Z] = [0-9] [cm]m', figure.p.text):
-                texts.append(current_text)
-                new_text = line.split('Scale bar: ', 1)[-1]
-                texts.append(new_text)
-                do_not_add = True
-                current_text = ''
+            if not letter_scale_bars:
+                yield SCALE_BAR, line.split('Scale bar: ', 1)[-1]
                 continue
         
-        if line.find(end_line) > -1:
-            is_end_text = True
-            add_to_text = False
-            if do_not_add:
-                current_text = line.split(end_line, 1)[-1]
-                break
-            current_text += line.split(end_line, 1)[0]
-            texts.append(current_text) 
-            
-            current_text = line.split(end_line, 1)[-1]
-            first_time_after_end = True
+        if end_line in line:
+            before, _, after = line.partition(end_line)
+            yield END_LINE, (before, after)
             continue
         
         if line in bolds:
+            yield LABEL, line
+            continue
+        
+        yield TEXT, line
+
+def parseCaptionTokens(tokens) -> (list, list):
+    '''
+    Returns the texts of the panels of a caption, in the order of its
+    labels, and its general texts (the photo source) from the tokens
+    given by tokenizeCaption. The text being read is kept as a list of
+    parts and only joined once complete.
+    '''
+    texts = []
+    generalTexts = []
+    current = []
+    # Reading the text of a label, before the end line
+    add_to_text = False
+    # Past the end line, where labels separate the general texts
+    is_end_text = False
+    general_to_text = False
+    first_time_after_end = False
+    # Height data was given separately, so the caption ends at the end line
+    do_not_add = False
+    
+    for kind, text in tokens:
+        
+        if kind == TEXT:
+            if add_to_text or is_end_text:
+                current.append(text)
+        
+        elif kind == LABEL:
             if is_end_text:
                 general_to_text = True
                 if first_time_after_end:
                     first_time_after_end = False
-                    current_text = ''
                 else:
-                    texts.append(current_text)
-                    current_text = ''
+                    texts.append(''.join(current))
+                current = []
                 continue
             
             add_to_text = True
-            if current_text == '':
-                continue
-            texts.append(current_text)
-            current_text = ''
-            
-            continue
+            if current:
+                current_text = ''.join(current)
+                if current_text != '':
+                    texts.append(current_text)
+                    current = []
         
-        if add_to_text:
-            current_text += line
+        elif kind == SCALE_BAR:
+            texts.append(''.join(current))
+            texts.append(text)
+            do_not_add = True
+            current = []
         
-        if is_end_text:
-            current_text += line
+        else:
+            # END_LINE
+            before, after = text
+            is_end_text = True
+            add_to_text = False
+            if do_not_add:
+                current = [after]
+                break
+            current.append(before)
+            texts.append(''.join(current))
+            current = [after]
+            first_time_after_end = True
     
     if add_to_text or general_to_text:
-        texts.append(current_text)
+        texts.append(''.join(current))
     else:
-        generalTexts.append(current_text)
-    return standartdizeFigureInfo(bolds, texts), generalTexts
+        generalTexts.append(''.join(current))
+    return texts, generalTexts
 
-def getTextFromNoBold(figure, taxon_name: str) -> list:
+def getTextFromNoBold(figure: FigureRecord) -> list:
     '''Returns the data if figure is not segmented into multiple parts'''
     # No first letter to ignore capitilaziton
-    if 'erbarium specimen' in figure.p.text:
+    if 'erbarium specimen' in figure.text:
         result = []
-        for text in splitIgnoreCapital(figure.p.text, '. '):
-            if taxon_name in text and '–' not in text:
+        for text in splitIgnoreCapital(figure.text, '. '):
+            if figure.taxon_name is not None and figure.taxon_name in text and '–' not in text:
                 continue
             
             if 'erbarium specimen' in text:
@@ -196,33 +298,22 @@ def getTextFromNoBold(figure, taxon_name: str) -> list:
             elif 'hotograph credit' in text:
                 result.append(text.split(': ', 1)[-1])
                 
-        patterns = [re.compile('[A-ZØ][a-zñ]+ & [A-Z][a-zñ]+ [0-9]+'),
-                    re.compile('[A-Z][a-zñ]+ [0-9]+'),
-                    re.compile('\([A-Z].*et al.*\)'),
-                    re.compile('[A-Z][a-zñ]+ et al.*\)'),
-                    re.compile('[A-Z][a-zñ]+ s.n.'), 
-                    ]
-        collection = getSingleRegexMatch(figure.p.text, patterns)
+        collection = getSingleRegexMatch(figure.text, SPECIMEN_COLLECTIONS)
         if collection:
             result = [txt.split(collection[0])[0] for txt in result]
             result.insert(1, collection[0])
             
         if not result:
-            return re.findall('[A-Z][a-z]+ [A-Z]+-[0-9]+', figure.p.text)
+            return SPECIMEN_ACCESSION.findall(figure.text)
         return result
     
-    patterns = [\
-                re.compile('[A-Z][.] [A-Z][a-z]+ [0-9]+'), \
-                re.compile('[A-Z][a-z]+ & [A-Z][a-z]+ [0-9]+'), \
-                re.compile('[A-Z][a-z]+ [0-9]+') \
-                ]
-    collection = getSingleRegexMatch(figure.p.text, patterns)
+    collection = getSingleRegexMatch(figure.text, ILLUSTRATION_COLLECTIONS)
     
     if collection:
         return collection
     
-    if 'drawn from ' in figure.p.text:
-        for text in figure.p.text.split('.'):
+    if 'drawn from ' in figure.text:
+        for text in figure.text.split('.'):
             if 'drawn from ' in text:
                 return [text.replace('drawn from ', '')]
             
@@ -235,57 +326,60 @@ def splitIgnoreCapital(text: str, sep: str) -> list:
     the split is captial letter
     '''
     result = []
-    current_text = ''
+    current_text = []
+    stripped_sep = sep.strip(' ')
     
-    # Standart split algorithm
-    while text != '':
-        index = text.find(sep)
+    # Standart split algorithm, moving a cursor along the text instead of
+    # slicing off the part already read, which made it quadratic
+    start = 0
+    end = len(text)
+    # Next occurrences of sep and of stripped_sep after the cursor, only searched again once passed
+    index = stripped_index = -2
+    while start < end:
+        if index < start and index != -1:
+            index = text.find(sep, start)
+        if stripped_index < start and stripped_index != -1:
+            stripped_index = text.find(stripped_sep, start)
         
         # If last letter of the text is the first occurance of sep in string, break
-        if text.find(sep.strip(' ')) == len(text) - 1:
-            result.append(text)
+        if stripped_index == end - 1:
+            result.append(text[start:])
             break
         
-        before_index_text = text[:index]
+        # Without sep in the rest of the text, the text before the last character is used
+        before_index_text = text[start:index] if index != -1 else text[start:end - 1]
         # Conditions to not seperate text
         if len(before_index_text) == 1 or \
-            ord(before_index_text[-1]) in range(ord('A'), ord('Z') + 1) or \
+            'A' <= before_index_text[-1] <= 'Z' or \
                 'acc' in before_index_text:
-            current_text += before_index_text + '.'
+            current_text.append(before_index_text)
+            current_text.append('.')
         
         # Further condition to not seperate text, as len(before_index_test) != 1
         elif before_index_text[-2] == ' ':
-            current_text += before_index_text + '.'
+            current_text.append(before_index_text)
+            current_text.append('.')
             
         else:
-            if current_text != '':
-                result.append(current_text)
-                current_text = ''
+            if current_text:
+                result.append(''.join(current_text))
+                current_text = []
             else:
                 result.append(before_index_text)
         
-        # Update text to be itself after the first occurance of sep, without sep
-        text = text[index+len(sep):]
+        # Move the cursor after the first occurance of sep
+        start = index + len(sep) if index != -1 else start + len(sep) - 1
         
     return result
             
-def getEndLineCondition(figure) -> str:
+def getEndLineCondition(text: str) -> str:
     '''
-    Returns the possible end line for given figure
-    These are found and ordered via manual checking.
+    Returns the possible end line for the given caption text
+    These are found and ordered via manual checking (see patternFunctions.END_LINES).
     If none exist in the figure, return <<PLACEHOLDER>>.
     '''
-    possibleEndLines = ['Photograph credits: ','permission of ', 'Drawn by ', 'Drawn By ', 
-                        'Adapted from ', 'Reproduced from ', 
-                        'Illustration by ', 'Drawing by ',
-                        'Courtesy of ', 'Photos By ', 'Photos by']
-    
     # Arbitrary string as placeholder - does not occur in any figure
-    end_line = 'PLACEHOLDER'
-    for _end_line in possibleEndLines:
-        if _end_line in figure.p.text:
-            end_line = _end_line
-    return end_line
+    return END_LINES.last(text, 'PLACEHOLDER')
 
 def getSingleRegexMatch(text: str, regexs: list) -> list:
     '''
@@ -293,7 +387,7 @@ def getSingleRegexMatch(text: str, regexs: list) -> list:
     Returns the first occurance as list
     '''
     for pattern in regexs:
-        result = re.findall(pattern, text)
+        result = pattern.findall(text)
         if result:
             return result
     return []
@@ -0,0 +1,153 @@
+import json
+import os
+import struct
+import threading
+import zlib
+
+# Last bytes of a figure store: the offset of its index, then this marker
+STORE_MAGIC = b'S2IFIGS1'
+FOOTER = struct.Struct('<Q8s')
+# The markup of the first figures written, up to this size, is the dictionary every frame is compressed with:
+# figures are small and alike, so on its own a frame would compress about three times less
+DICTIONARY_BYTES = 16384
+
+def figureStorePath(output_file: str) -> str:
+    '''
+    Returns where the figure markup of a species-descriptions.txt file is stored,
+    next to it: data/<doi>/species-descriptions.figures
+    '''
+    return os.path.splitext(output_file)[0] + '.figures'
+
+def isReference(value: str) -> bool:
+    '''Whether a Figure Object field refers to the figure store rather than holding the markup itself'''
+    return value.isdigit()
+
+class FigureStoreWriter:
+    '''
+    Writes the markup of figures to a figure store: a single file of
+    compressed frames, one per figure, followed by an index of their
+    labels and positions. add returns the reference written to the
+    Figure Object column in place of the markup, ie the number of the
+    figure in the store. The store replaces any former one only once
+    closed, and is discarded if writing fails.
+    '''
+    def __init__(self, path: str, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.path = path
+        self.part_path = path + '.part'
+        self.level = level
+        self.dictionary = None
+        # Figures added before the dictionary is complete
+        self.buffered = []
+        self.buffered_bytes = 0
+        self.index = []
+        self.offset = 0
+        self.f_out = open(self.part_path, 'wb')
+
+    def add(self, label: str, markup: str) -> str:
+        reference = str(len(self.index) + len(self.buffered))
+        data = markup.encode('utf8')
+        if self.dictionary is None:
+            self.buffered.append((label, data))
+            self.buffered_bytes += len(data)
+            if self.buffered_bytes >= DICTIONARY_BYTES:
+                self.writeBuffered()
+        else:
+            self.writeFrame(label, data)
+        return reference
+
+    def writeBuffered(self) -> None:
+        # Cut at a character boundary, as the dictionary is stored as text
+        self.dictionary = b''.join(data for _, data in self.buffered)[:DICTIONARY_BYTES] \
+            .decode('utf8', 'ignore').encode('utf8')
+        for label, data in self.buffered:
+            self.writeFrame(label, data)
+        self.buffered = []
+
+    def writeFrame(self, label: str, data: bytes) -> None:
+        compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        frame = compressor.compress(data) + compressor.flush()
+        self.f_out.write(frame)
+        self.index.append([label, self.offset, len(frame)])
+        self.offset += len(frame)
+
+    def close(self) -> None:
+        if self.dictionary is None:
+            self.writeBuffered()
+        footer = {'dictionary': self.dictionary.decode('utf8'), 'figures': self.index}
+        self.f_out.write(zlib.compress(json.dumps(footer, ensure_ascii=False).encode('utf8')))
+        self.f_out.write(FOOTER.pack(self.offset, STORE_MAGIC))
+        self.f_out.close()
+        os.replace(self.part_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f_out.close()
+            os.remove(self.part_path)
+
+class FigureStore:
+    '''
+    Reads the figures of a figure store written by FigureStoreWriter.
+    A figure is read with a single seek, by its reference (read) or by
+    its label (get), only the index being kept in memory.
+    The instance can be shared between threads, but not between processes.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f_in = open(path, 'rb')
+        self.f_in.seek(-FOOTER.size, os.SEEK_END)
+        footer_offset = self.f_in.tell()
+        index_offset, magic = FOOTER.unpack(self.f_in.read(FOOTER.size))
+        if magic != STORE_MAGIC:
+            raise ValueError('{} is not a figure store'.format(path))
+        self.f_in.seek(index_offset)
+        footer = json.loads(zlib.decompress(self.f_in.read(footer_offset - index_offset)))
+        self.dictionary = footer['dictionary'].encode('utf8')
+        self.index = footer['figures']
+        # Label -> number of the first figure with that label
+        self.labels = {}
+        for number, (label, _, _) in enumerate(self.index):
+            self.labels.setdefault(label, number)
+
+    def readFigure(self, number: int) -> str:
+        _, offset, length = self.index[number]
+        with self.lock:
+            self.f_in.seek(offset)
+            frame = self.f_in.read(length)
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return (decompressor.decompress(frame) + decompressor.flush()).decode('utf8')
+
+    def read(self, reference: str) -> str:
+        '''Returns the markup of the figure written with reference'''
+        return self.readFigure(int(reference))
+
+    def get(self, label: str) -> str:
+        '''Returns the markup of the (first) figure with label, KeyError if there is none'''
+        return self.readFigure(self.labels[label])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __iter__(self):
+        '''Yields (label, markup) for every figure, in the order they were written'''
+        for number, (label, _, _) in enumerate(self.index):
+            yield label, self.readFigure(number)
+
+    def close(self) -> None:
+        self.f_in.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def openFigureStore(output_file: str):
+    '''Returns the FigureStore of a species-descriptions.txt file, None if its figures are written inline'''
+    path = figureStorePath(output_file)
+    return FigureStore(path) if os.path.exists(path) else None
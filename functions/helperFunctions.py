@@ -1,4 +1,8 @@
-import re
+from collections import Counter
+from functools import lru_cache
+from types import MappingProxyType
+
+from functions.patternFunctions import MISPLACED_LETTER_RANGE, misplacedLetterPattern
 
 def splitTextFromList(text: str, lst: list[str], indexes: list[int] = None) -> str:
     '''
@@ -31,7 +35,7 @@ def customLoopCount(char: str, lst: list) -> int:
     Returns the count of all occurances of char letter in list
     'B' in 'A-E' will count as an occurance.
     '''
-    return sum([1 for text in lst if char in letter2CorrectList(text)])
+    return labelLoopCounts(tuple(lst)).get(char, 0)
 
 def correctList(lst: list) -> list:
     '''
@@ -39,11 +43,7 @@ def correctList(lst: list) -> list:
     'A-C' to ['A', 'B', 'C']
     'A, C' to ['A', 'C']
     '''
-    new_lst = []
-    for text in lst:
-        new_lst += letter2CorrectList(text)
-    
-    return new_lst
+    return list(expandLabels(tuple(lst)))
     
 def customLetterCount(lst: list) -> int:
     '''
@@ -53,9 +53,7 @@ def customLetterCount(lst: list) -> int:
     'G' (71) - 'A' (65) + 1 = 7 returns this value
     G is the 7th letter of the alphabet
     '''
-    new_lst = correctList(lst)
-    return ord(sorted(new_lst)[-1]) - ord('A') + 1
-
+    return labelLetterCount(tuple(lst))
 
 def hyphon2Comma(text: str, hyphonText: str = '–') -> str:
     '''
@@ -84,7 +82,36 @@ def comma2List(text: str) -> list:
 
 def letter2CorrectList(text: str, hyphonText: str = '–') -> list:
     '''Converts a list of strings based on above-mentioned rules'''
-    return comma2List(hyphon2Comma(text, hyphonText=hyphonText))
+    return list(expandLabel(text, hyphonText))
+
+# The same few dozen bold labels occur in the captions of every article, so
+# their expansion into panel letters is only computed once. The caches are
+# bounded, as any bold string of a caption is looked up, and corpus workers
+# run for a long time. The bulk versions take the bold labels of a whole
+# figure as a tuple.
+
+@lru_cache(maxsize=1024)
+def expandLabel(text: str, hyphonText: str = '–') -> tuple:
+    '''Returns the panel letters of a bold label, eg 'A–C' -> ('A', 'B', 'C')'''
+    return tuple(comma2List(hyphon2Comma(text, hyphonText=hyphonText)))
+
+@lru_cache(maxsize=4096)
+def expandLabels(labels: tuple) -> tuple:
+    '''Returns the panel letters of all the bold labels of a figure, in order'''
+    return tuple(letter for label in labels for letter in expandLabel(label))
+
+@lru_cache(maxsize=4096)
+def labelLoopCounts(labels: tuple) -> MappingProxyType:
+    '''
+    Returns how many of the bold labels of a figure include each panel letter,
+    read-only as the same mapping is returned to every caller
+    '''
+    return MappingProxyType(Counter(letter for label in labels for letter in set(expandLabel(label))))
+
+@lru_cache(maxsize=4096)
+def labelLetterCount(labels: tuple) -> int:
+    '''Returns the number of panels of a figure given its bold labels, see customLetterCount'''
+    return ord(sorted(expandLabels(labels))[-1]) - ord('A') + 1
 
 def cleanText(text: str, text2Cleaned: list) -> str:
     '''Removes all the strings in text2cleaned from text'''
@@ -107,9 +134,9 @@ def fixNonStandartLabels(letters, texts):
     saved_index = -1
     for i, text in enumerate(texts):
         max_letter = chr(ord(max(letters)[0]) + 1)
-        misplacedTexts = re.findall("[A-Za-z]-[A-Za-z]\s", text)
+        misplacedTexts = MISPLACED_LETTER_RANGE.findall(text)
         if not misplacedTexts:
-            misplacedTexts = re.findall(f'[A-{max_letter}],*\s', text)
+            misplacedTexts = misplacedLetterPattern(max_letter).findall(text)
         
         
         
@@ -0,0 +1,635 @@
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from functions.compressionFunctions import compressFile, decompressFile, isCompressedPath
+
+HTTP_CACHE_DIR = '.cache/http'
+CHUNK_SIZE = 64 * 1024
+# Errors after which an interrupted download is resumed
+RESUMABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+# Responses after which the scheduler backs off and retries the request
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Default request rate allowed per host
+REQUESTS_PER_SECOND = 10.0
+# Default number of transfers in progress at once per host
+MAX_CONCURRENCY = 8
+# A lock file older than this is taken to be left over by a process that died holding it
+STALE_LOCK_SECONDS = 600
+# Mode of the files written through a temporary file, which mkstemp creates readable by the owner only:
+# the one open() would give them, read once at import as os.umask can only be read by setting it
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+class TokenBucket:
+    '''
+    Allows on average rate requests per second, with bursts of up to burst
+    requests. pause() blocks every caller for a while (eg after Retry-After).
+    '''
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class HostScheduler:
+    '''
+    Schedules the requests of every session of the process per host:
+    each host has a token bucket (rate requests per second, or the rate
+    given for it in host_rates) and at most max_concurrency transfers in
+    progress. A transfer lasts until its body has been read or the
+    response closed, so with stream=True it is not over when the headers
+    arrive. Responses with a status in RETRY_STATUSES are retried up to
+    max_retries times, waiting for the Retry-After header if the server
+    sent one, or else with jittered exponential backoff. A Retry-After
+    longer than max_backoff exhausts the budget and the response is returned.
+    '''
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, burst: int = 10, max_concurrency: int = MAX_CONCURRENCY, max_retries: int = 5,
+                 backoff: float = 0.5, max_backoff: float = 60.0, host_rates: dict = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.host_rates = host_rates or {}
+        self.buckets = {}
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def hostState(self, host: str) -> (TokenBucket, threading.Semaphore):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.host_rates.get(host, self.rate), self.burst)
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_concurrency)
+            return self.buckets[host], self.semaphores[host]
+
+    def retryDelay(self, response, attempt: int) -> float:
+        '''Returns how long to wait before retrying after response'''
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def send(self, send, request):
+        '''Sends request with send(), once the host allows it, retrying throttled and failed responses'''
+        bucket, semaphore = self.hostState(urlsplit(request.url).netloc)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            semaphore.acquire()
+            try:
+                response = send()
+            except BaseException:
+                semaphore.release()
+                raise
+            releaseWhenDone(response, semaphore.release)
+            if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries \
+                    or request.method not in ('GET', 'HEAD'):
+                return response
+            delay = self.retryDelay(response, attempt)
+            if delay > self.max_backoff:
+                return response
+            response.close()
+            if response.headers.get('Retry-After'):
+                # The host asked every client to wait, not only this request
+                bucket.pause(delay)
+            time.sleep(delay)
+            attempt += 1
+
+def releaseWhenDone(response, release) -> None:
+    '''
+    Calls release once, when the body of response has been read in full or
+    the response closed (both of which release its connection), or at the
+    latest when the response is garbage collected
+    '''
+    lock = threading.Lock()
+    released = []
+    def releaseOnce():
+        with lock:
+            if released:
+                return
+            released.append(True)
+        release()
+
+    raw = response.raw
+    release_conn = getattr(raw, 'release_conn', None)
+    if release_conn is None:
+        releaseOnce()
+        return
+    def releaseConn():
+        try:
+            release_conn()
+        finally:
+            releaseOnce()
+    raw.release_conn = releaseConn
+    weakref.finalize(response, releaseOnce)
+
+class ScheduledAdapter(HTTPAdapter):
+    '''HTTPAdapter which sends every request through a HostScheduler'''
+    def __init__(self, scheduler: HostScheduler, **kwargs):
+        self.scheduler = scheduler
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        return self.scheduler.send(lambda: super(ScheduledAdapter, self).send(request, **kwargs), request)
+
+class HttpArchive:
+    '''
+    Single-file archive (SQLite) of HTTP responses indexed by method and url.
+    In 'record' mode every response received is stored; in 'replay' mode
+    responses are served from the archive and the network is never used,
+    so pipeline runs are deterministic and independent of the network.
+    '''
+    MODES = ('record', 'replay')
+
+    def __init__(self, path: str, mode: str):
+        if mode not in self.MODES:
+            raise ValueError('Archive mode must be one of {}, not {}'.format(self.MODES, mode))
+        if mode == 'replay' and not os.path.exists(path):
+            raise FileNotFoundError('No HTTP archive to replay at {}'.format(path))
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses (method TEXT, url TEXT, status INTEGER, '
+                                    'headers TEXT, body BLOB, PRIMARY KEY (method, url))')
+
+    def put(self, method: str, url: str, status: int, headers: dict, body: bytes) -> None:
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (method, url, status, json.dumps(dict(headers)), body))
+
+    def get(self, method: str, url: str) -> (int, dict, bytes):
+        '''Returns the status, headers and body archived for the request, or None'''
+        with self.lock:
+            row = self.connection.execute('SELECT status, headers, body FROM responses WHERE method = ? AND url = ?',
+                                          (method, url)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def close(self) -> None:
+        self.connection.close()
+
+# Request headers that would make the server answer with less than the full resource
+PARTIAL_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since', 'Range', 'If-Range')
+
+class RecordingAdapter(ScheduledAdapter):
+    '''ScheduledAdapter which stores every response it receives in an HttpArchive'''
+    def __init__(self, archive: HttpArchive, scheduler: HostScheduler, **kwargs):
+        self.archive = archive
+        super().__init__(scheduler, **kwargs)
+
+    def send(self, request, **kwargs):
+        # Always record the full resource, so that it can be replayed to any request
+        request = request.copy()
+        for header in PARTIAL_REQUEST_HEADERS:
+            request.headers.pop(header, None)
+        response = super().send(request, **kwargs)
+        self.archive.put(request.method, request.url, response.status_code, response.headers, response.content)
+        return response
+
+class ReplayAdapter(HTTPAdapter):
+    '''
+    Adapter which answers every request from an HttpArchive without using
+    the network, including conditional (304) and Range (206) requests.
+    '''
+    def __init__(self, archive: HttpArchive, **kwargs):
+        self.archive = archive
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        archived = self.archive.get(request.method, request.url)
+        if archived is None:
+            raise requests.ConnectionError('{} {} is not in the HTTP archive'.format(request.method, request.url),
+                                           request=request)
+        status, headers, body = archived
+        headers = CaseInsensitiveDict(headers)
+
+        if status == 200:
+            etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+            if (etag and request.headers.get('If-None-Match') == etag) or \
+                    (last_modified and request.headers.get('If-Modified-Since') == last_modified):
+                status, body = 304, b''
+            elif request.headers.get('Range', '').startswith('bytes=') and \
+                    request.headers.get('If-Range') in (None, etag, last_modified):
+                start = int(request.headers['Range'][len('bytes='):].split('-')[0])
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body))
+                status, body = 206, body[start:]
+        headers['Content-Length'] = str(len(body))
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = headers
+        response.encoding = get_encoding_from_headers(headers)
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+# Shared by all sessions created by createSession, see configureScheduler and configureArchive
+SCHEDULER = HostScheduler()
+ARCHIVE = None
+
+def configureScheduler(**kwargs) -> HostScheduler:
+    '''Replaces the scheduler shared by sessions created from now on (see HostScheduler for the arguments)'''
+    global SCHEDULER
+    SCHEDULER = HostScheduler(**kwargs)
+    return SCHEDULER
+
+def configureArchive(path: str, mode: str) -> HttpArchive:
+    '''Records to or replays from the HTTP archive at path in sessions created from now on'''
+    global ARCHIVE
+    ARCHIVE = HttpArchive(path, mode)
+    return ARCHIVE
+
+def createSession(pool_size: int = 10, scheduler: HostScheduler = None) -> requests.Session:
+    '''
+    Returns a requests Session whose connection pools can hold
+    pool_size keep-alive connections per host, so that worker
+    threads sharing the session reuse connections instead of
+    opening a new one for every request.
+    Requests are rate limited and retried by scheduler, by default
+    the scheduler shared by the whole process, and recorded to or
+    replayed from the HTTP archive if one is configured.
+    '''
+    session = requests.Session()
+    if ARCHIVE is not None and ARCHIVE.mode == 'replay':
+        adapter = ReplayAdapter(ARCHIVE)
+    elif ARCHIVE is not None:
+        adapter = RecordingAdapter(ARCHIVE, scheduler or SCHEDULER, pool_connections=pool_size, pool_maxsize=pool_size)
+    else:
+        adapter = ScheduledAdapter(scheduler or SCHEDULER, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def writeAtomic(path: str, data: bytes) -> None:
+    '''Writes data to path via a temporary file, so path is never left half written'''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f_out:
+            f_out.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+@contextmanager
+def lockFile(path: str, poll: float = 0.05):
+    '''
+    Holds the lock file at path for the duration of the with block. The
+    file is created exclusively, so only one thread or process at a time
+    (eg the workers of a corpus run sharing a cache) can hold it.
+    '''
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll)
+    try:
+        yield
+    finally:
+        os.remove(path)
+
+@contextmanager
+def tryLockFile(path: str):
+    '''Like lockFile, but does not wait for a lock held elsewhere: yields whether the lock was taken'''
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        os.remove(path)
+
+def copyAtomic(input_file: str, output_file: str) -> None:
+    '''Copies input_file to output_file via a temporary file, so output_file is never left half written'''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_file) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f_out, open(input_file, 'rb') as f_in:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def hashFile(path: str, hasher=None):
+    '''Feeds the bytes of the file at path to hasher (a new SHA-256 by default) and returns it'''
+    if hasher is None:
+        hasher = hashlib.sha256()
+    with open(path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+def writeChecksum(path: str, sha256: str) -> None:
+    '''Records sha256 next to path as path.sha256, in the format read by sha256sum -c'''
+    writeAtomic(path + '.sha256', '{}  {}\n'.format(sha256, os.path.basename(path)).encode('utf8'))
+
+def readPartValidator(part_path: str, url: str) -> str:
+    '''Returns the validator (ETag or Last-Modified) saved for the .part file of url, or None'''
+    try:
+        with open(part_path + '.json', 'r', encoding='utf8') as f_in:
+            saved = json.load(f_in)
+        return saved['validator'] if saved.get('url') == url else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+def removePart(part_path: str) -> None:
+    '''Removes a .part file and its saved validator'''
+    for path in (part_path, part_path + '.json'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def downloadFile(session, url: str, output_file: str, headers: dict = None, retries: int = 3):
+    '''
+    Streams the body of url to output_file in chunks, never holding the
+    whole body in memory. Bytes are written to output_file.part, which is
+    renamed over output_file only once complete; if the transfer breaks,
+    it is resumed from the end of the .part file with a Range request.
+    The validator (ETag or Last-Modified) of the response is saved next to
+    the .part file (output_file.part.json) and sent as If-Range, so a
+    transfer is only resumed, even by a later run, if the resource has not
+    changed; a .part file without a saved validator is downloaded again.
+    Returns the response and the SHA-256 hex digest of the body, computed
+    while streaming. If the server answers 304 Not Modified to the given
+    conditional headers, nothing is written and the digest is None.
+    '''
+    part_path = output_file + '.part'
+
+    for attempt in range(retries + 1):
+        request_headers = dict(headers or {})
+        validator = readPartValidator(part_path, url)
+        if validator is None:
+            removePart(part_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset:
+            request_headers['Range'] = 'bytes={}-'.format(offset)
+            # Only resume if the resource has not changed in the meantime
+            request_headers['If-Range'] = validator
+        try:
+            with session.get(url, headers=request_headers, stream=True) as r:
+                if r.status_code in (304, 416):
+                    # Read the (empty) body, otherwise closing the response closes its connection instead
+                    # of returning it to the pool
+                    r.content
+                if r.status_code == 304:
+                    return r, None
+                if r.status_code == 416:
+                    # The .part file does not match the resource any more: start again from zero
+                    removePart(part_path)
+                    if attempt == retries:
+                        r.raise_for_status()
+                    continue
+                r.raise_for_status()
+
+                hasher = hashlib.sha256()
+                if r.status_code == 206 and offset and \
+                        r.headers.get('Content-Range', '').startswith('bytes {}-'.format(offset)):
+                    # Resume: the digest must also cover the bytes already on disk
+                    hashFile(part_path, hasher)
+                    mode = 'ab'
+                else:
+                    if r.status_code == 206:
+                        # A range other than the one asked for: the body is downloaded again in full
+                        removePart(part_path)
+                        continue
+                    mode = 'wb'
+                    new_validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+                    if new_validator:
+                        writeAtomic(part_path + '.json', json.dumps({'url': url, 'validator': new_validator}).encode('utf8'))
+                    else:
+                        removePart(part_path)
+
+                with open(part_path, mode) as f_out:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        hasher.update(chunk)
+                        f_out.write(chunk)
+            break
+        except RESUMABLE_ERRORS:
+            if attempt == retries:
+                raise
+    else:
+        raise requests.ConnectionError('Could not download {} in {} attempts'.format(url, retries + 1))
+
+    os.replace(part_path, output_file)
+    removePart(part_path)
+    return r, hasher.hexdigest()
+
+class HttpCache:
+    '''
+    On-disk store of downloaded resources keyed by url. Each body is kept
+    with a .json sidecar holding the ETag/Last-Modified validators sent by
+    the server, so that an unchanged resource only costs a conditional
+    request answered with 304 Not Modified.
+    If max_bytes is given, the least recently used bodies are evicted
+    whenever the store grows beyond that size. If compressed, the bodies
+    are stored gzip compressed (text such as article XML takes about a
+    twentieth of the space). Either way fetch writes output_file compressed
+    if its name ends with .gz, and plain otherwise.
+    '''
+    def __init__(self, cache_dir: str, max_bytes: int = None, compressed: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compressed = compressed
+        self.lock = threading.Lock()
+        # Running total of the store size, computed on first use
+        self.size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def bodyPath(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf8')).hexdigest())
+
+    def readValidators(self, url: str) -> dict:
+        '''Returns the stored validators of url, or None if url is not in the cache'''
+        body_path = self.bodyPath(url)
+        if not os.path.exists(body_path):
+            return None
+        try:
+            with open(body_path + '.json', 'r', encoding='utf8') as f_in:
+                return json.load(f_in)
+        except (OSError, ValueError):
+            return None
+
+    def fetch(self, session, url: str, output_file: str) -> (bool, str):
+        '''
+        Writes the resource at url to output_file, revalidating any cached
+        copy with If-None-Match/If-Modified-Since.
+        Returns whether the body was downloaded (False if the cached copy
+        was used) and its SHA-256 hex digest.
+        '''
+        body_path = self.bodyPath(url)
+        # Only one writer per entry: others wait, then revalidate what it downloaded
+        with lockFile(body_path + '.lock'):
+            validators = self.readValidators(url)
+
+            headers = {}
+            if validators is not None:
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last_modified'):
+                    headers['If-Modified-Since'] = validators['last_modified']
+
+            # A compressed body is downloaded next to the entry, then compressed into it
+            download_path = body_path + '.download' if self.compressed else body_path
+            r, sha256 = downloadFile(session, url, download_path, headers)
+            if sha256 is None and not os.path.exists(body_path):
+                # Not modified, but the cached body is gone (eg deleted by hand): downloaded in full
+                r, sha256 = downloadFile(session, url, download_path)
+            downloaded = sha256 is not None
+            if downloaded:
+                if self.compressed:
+                    compressFile(download_path, body_path)
+                    os.remove(download_path)
+                size = os.path.getsize(body_path)
+                validators = {'url': url,
+                              'etag': r.headers.get('ETag'),
+                              'last_modified': r.headers.get('Last-Modified'),
+                              'size': size,
+                              'sha256': sha256,
+                              'compressed': self.compressed}
+                writeAtomic(body_path + '.json', json.dumps(validators).encode('utf8'))
+            else:
+                # Mark as recently used for the eviction policy
+                os.utime(body_path)
+                sha256 = validators.get('sha256') or hashFile(body_path).hexdigest()
+
+            # Entries cached before bodies could be stored compressed have no 'compressed' field
+            stored_compressed = validators.get('compressed', False)
+            if stored_compressed == isCompressedPath(output_file):
+                copyAtomic(body_path, output_file)
+            elif stored_compressed:
+                decompressFile(body_path, output_file)
+            else:
+                compressFile(body_path, output_file)
+
+        if downloaded and self.max_bytes is not None:
+            self.evict(size)
+        return downloaded, sha256
+
+    def evict(self, added_bytes: int = 0) -> None:
+        '''Removes the least recently used entries until the store fits in max_bytes'''
+        with self.lock:
+            if self.size is not None:
+                self.size += added_bytes
+                if self.size <= self.max_bytes:
+                    return
+
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(('.json', '.tmp', '.part', '.lock', '.download')):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            self.size = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if self.size <= self.max_bytes:
+                    break
+                # An entry being fetched (by any thread or process) is in use, so it is left alone
+                with tryLockFile(path + '.lock') as locked:
+                    if not locked:
+                        continue
+                    for stale_path in (path, path + '.json'):
+                        try:
+                            os.remove(stale_path)
+                        except FileNotFoundError:
+                            pass
+                self.size -= size
+
+class DownloadQueue:
+    '''
+    Bounded pool of worker threads draining a queue of downloads, so that
+    the caller can keep parsing and writing output while files download.
+    At most max_pending downloads wait in the queue; submit() blocks when
+    it is full. join() waits for every download and re-raises the first error.
+    '''
+    def __init__(self, workers: int = 4, max_pending: int = None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending or workers * 2)
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.slots.acquire()
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def join(self) -> None:
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Do not start queued downloads if the producer failed
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            return False
+        self.join()
+        return False
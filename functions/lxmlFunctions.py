@@ -0,0 +1,113 @@
+from lxml import etree
+
+from functions.compressionFunctions import articleSource
+from functions.figureFunctions import FigureRecord
+from functions.streamFunctions import getContentsText, getText, iterStrings, serialise
+
+# The figureFunctions getters for an lxml tree instead of a BeautifulSoup one.
+# As with BeautifulSoup, unprefixed names match any prefix (local-name) and
+# prefixed names match the prefix used in the document (name).
+FIGURES = etree.XPath('//*[local-name()="fig"]')
+FIRST_LABEL = etree.XPath('(.//*[local-name()="label"])[1]')
+FIRST_TITLE = etree.XPath('(.//*[local-name()="title"])[1]')
+FIRST_PARAGRAPH = etree.XPath('(.//*[local-name()="p"])[1]')
+FIRST_CAPTION_PARAGRAPH = etree.XPath('(.//*[local-name()="caption"])[1]/descendant::*[local-name()="p"][1]')
+FIRST_URI = etree.XPath('(.//*[local-name()="uri"])[1]')
+BOLDS = etree.XPath('.//*[local-name()="bold"]')
+FIRST_TAXON_NAME = etree.XPath('(.//*[name()="tp:nomenclature"])[1]/descendant::*[name()="tp:taxon-name"][1]')
+TAXON_NAME_PARTS = etree.XPath('.//*[name()="tp:taxon-name-part"]')
+# Recovers from the namespace prefixes of a figure taken out of its article being undeclared
+FIGURE_PARSER = etree.XMLParser(recover=True)
+
+def first(xpath, elem):
+    '''Returns the first element selected by xpath from elem, or None'''
+    if elem is None:
+        return None
+    result = xpath(elem)
+    return result[0] if result else None
+
+def getSection(figure) -> str:
+    '''Returns the title of the section the figure is in, without full stops'''
+    title = first(FIRST_TITLE, figure.getparent())
+    return getText(title).replace('.', '') if title is not None else None
+
+def getDescription(figure) -> str:
+    '''Returns the description text for the figure from its parent object'''
+    paragraph = first(FIRST_PARAGRAPH, figure.getparent())
+    return getContentsText(paragraph) if paragraph is not None else None
+
+def getTaxonName(figure) -> str:
+    '''Returns the taxon name of the plant illustrated in the figure'''
+    parent = figure.getparent()
+    taxon_name = first(FIRST_TAXON_NAME, parent.getparent() if parent is not None else None)
+    if taxon_name is None:
+        return None
+    return ' '.join([getText(part) for part in TAXON_NAME_PARTS(taxon_name)])
+
+def getLabel(figure) -> str:
+    '''Returns the label of the figure, eg Figure 1'''
+    label = first(FIRST_LABEL, figure)
+    return getText(label).replace('.', '') if label is not None else None
+
+def getCaptionText(figure) -> str:
+    '''Returns the caption text of the figure'''
+    paragraph = first(FIRST_CAPTION_PARAGRAPH, figure)
+    return getContentsText(paragraph) if paragraph is not None else None
+
+def getUrl(figure) -> str:
+    '''Returns the url of the figure'''
+    uri = first(FIRST_URI, figure)
+    return getText(uri) if uri is not None else None
+
+def getParagraphText(figure) -> str:
+    '''Returns the text of the first paragraph of the figure, ie its caption'''
+    paragraph = first(FIRST_PARAGRAPH, figure)
+    return getText(paragraph) if paragraph is not None else ''
+
+def getStrings(figure) -> list:
+    '''Returns the strings of the first paragraph of the figure in document order'''
+    paragraph = first(FIRST_PARAGRAPH, figure)
+    return list(iterStrings(paragraph)) if paragraph is not None else []
+
+def getBolds(figure) -> list:
+    '''Returns the text of every bold element of the figure'''
+    return [getText(bold) for bold in BOLDS(figure)]
+
+def getMarkup(figure) -> str:
+    '''Returns the markup of the figure as BeautifulSoup would write it'''
+    # Namespaces declared within the figure, which BeautifulSoup keeps as attributes
+    declarations = {}
+    for elem in figure.iter(tag=etree.Element):
+        parent = elem.getparent()
+        inherited = parent.nsmap if parent is not None else {}
+        declared = [(prefix, namespace) for prefix, namespace in elem.nsmap.items() if inherited.get(prefix) != namespace]
+        if declared:
+            declarations[elem] = declared
+    parts = []
+    serialise(figure, declarations, parts)
+    return ''.join(parts)
+
+# Field of FigureRecord -> function extracting it from an lxml <fig> element
+ACCESSORS = {'label': getLabel, 'taxon_name': getTaxonName, 'description': getDescription, 'section': getSection,
+             'caption_text': getCaptionText, 'url': getUrl, 'xml': getMarkup, 'text': getParagraphText,
+             'strings': getStrings, 'bolds': getBolds}
+
+def figure2Record(figure) -> FigureRecord:
+    '''Returns the FigureRecord of an lxml <fig> element'''
+    return FigureRecord(**{field: accessor(figure) for field, accessor in ACCESSORS.items()})
+
+def parseArticle(input_file: str):
+    '''
+    Parses the whole article into an lxml tree, recovering from errors like
+    BeautifulSoup does, and decompressing it if it is compressed
+    '''
+    with articleSource(input_file) as source:
+        return etree.parse(source, etree.XMLParser(recover=True))
+
+def parseFigure(markup: str):
+    '''Parses the markup of a single figure, eg the Figure Object column of species-descriptions.txt'''
+    return etree.fromstring(markup, FIGURE_PARSER)
+
+def getFigures(tree) -> list:
+    '''Returns every <fig> element of the article in document order'''
+    return FIGURES(tree)
@@ -1,13 +1,15 @@
 import numpy as np
 import pandas as pd
-import re
 import os
+from itertools import islice
 
 # import sys
 # functions_path = 'C:/Users/eka10kg/OneDrive - The Royal Botanic Gardens, Kew/functions'
 # if functions_path not in sys.path:
 #     sys.path.append(functions_path)
-import functions.figureFunctions
+import functions.figureFunctions as figureFunctions
+from functions.patternFunctions import ARTICLE6_COLLECTIONS, DESCRIPTION_TEXT, HEIGHT_TEXT, HERBARIUM_SPECIMEN_TEXT, \
+    SEGMENT_FIELD
 
 GLOBAL_COLUMNS = ['Description', 'Collection', 'Height', 'Photo Credits'] # Photo Source Individual olabilir Article 6
 # helper function cleantextden parantezleri cikar article 6 ya bak
@@ -28,26 +30,48 @@ def text2Index(text: str) -> int:
     1: Collection - as there are many different ways, if data does not fit above
     criteria, it is collection
     '''
-    description_match = re.match('^\s[^0-9]*\s$', text) # ARTICLE 6
+    description_match = DESCRIPTION_TEXT.match(text) # ARTICLE 6
     if not description_match:
-        description_match = re.match('(\s)?Herbarium specimen .*', text)
+        description_match = HERBARIUM_SPECIMEN_TEXT.match(text)
     if description_match:
         return 0 # Index of Description
     
-    height_match = re.match('[0-9]+(\.)?[0-9]* [cm]m', text)
+    height_match = HEIGHT_TEXT.match(text)
     if height_match:
         return 2 # Index of Height
     
     return 1 # Index of Collection
 
+def text2Indexes(texts) -> np.ndarray:
+    '''
+    Vectorized text2Index: returns the index of every text in texts (eg all
+    the attributes of every figure, as a list or pandas Series) as an array.
+    Each distinct text is classified only once, with a single match of the
+    combined patterns, and the indexes are spread back to every occurrence.
+    '''
+    codes, uniques = pd.factorize(pd.Series(texts, dtype=object))
+    indexes = np.ones(len(uniques), dtype=np.int8) # Index of Collection
+    for i, text in enumerate(uniques):
+        match = SEGMENT_FIELD.match(text)
+        if match:
+            indexes[i] = 2 if match.group('height') is not None else 0
+    return indexes[codes]
+
 # TODO: Do not forget to make sure article_6 are passed correctly
-def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, general_data: list, article_id: int = 0):
+def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, general_data: list, article_id: int = 0,
+                          text_indexes: dict = None):
     '''
     Returns general_data, figure_info, photo_source as a single numpy inorder array of shape
     (len(figure_info), 8) to be used as data in upcoming dataFrames 
+    text_indexes maps texts to their text2Index, computed beforehand with text2Indexes.
+    The array holds references to the texts (dtype object), so texts of any length
+    are kept whole and general_data is shared by all the rows rather than copied.
     '''
+    classify = text2Index
+    if text_indexes:
+        classify = lambda text: text_indexes[text] if text in text_indexes else text2Index(text)
     length = 4 # Specific Data Column Count
-    result_array = np.zeros((len(figure_info), length), dtype='<U511')
+    result_array = np.full((len(figure_info), length), '', dtype=object)
     
     if article_id == 6:
         figure_info = fixArticle6(figure_info, photo_source)
@@ -59,14 +83,9 @@ def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, gene
     # Simplify the addition of photo_source: list[str]|[]
     photo_source = photo_source[0] if photo_source else ''
     
-    general_datas = []
-    
     for i, key in enumerate(sorted(figure_info)):
         attributes = figure_info[key]
         
-        # Static through the for loop, matches the shape of result array
-        general_datas.append(general_data)    
-        
         # Only for Atricle 6 where photo_source is independent
         if article_id == 6 and not photo_source:
             result_array[i] = [attributes[0], # Description
@@ -83,7 +102,7 @@ def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, gene
         # attributes has 1 element --> either collection or description
         elif len(attributes) == 1:
             text = attributes[0]
-            j = text2Index(text)
+            j = classify(text)
             result_array[i] = [text if j == idx else '' for idx in range(length)]
             
             lengths_for_error.append(1)
@@ -94,7 +113,7 @@ def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, gene
             none_idx = length - 1 
             for text in attributes:
                 
-                j = text2Index(text)
+                j = classify(text)
                 result_array[i, j] = text
                 
                 # if j was 0,1 -> 3-1-0=2
@@ -110,7 +129,7 @@ def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, gene
             
         elif len(attributes) == 3:
             for text in attributes:
-                j = text2Index(text)
+                j = classify(text)
                 
                 if result_array[i, j] == '':
                     result_array[i, j] = text
@@ -132,6 +151,9 @@ def figureInfo2NumpyArray(figure_info: dict[str, list], photo_source: list, gene
         # Move overwritten_text to label with current length 1
         result_array[idx_1, 1] = overwritten_text
     
+    # Static for every row, matches the shape of result array
+    general_datas = np.empty((len(figure_info), len(general_data)), dtype=object)
+    general_datas[:] = np.array(general_data, dtype=object)
     return np.concatenate((general_datas, result_array), axis=1)
 
 def multipleRegex2Span(patterns: list, text: str) -> (int, int):
@@ -142,7 +164,7 @@ def multipleRegex2Span(patterns: list, text: str) -> (int, int):
     any(result) bool check.
     '''
     for pattern in patterns:
-        if search := re.search(pattern, text):
+        if search := pattern.search(text):
             return search.span()
     
     return (0, 0)
@@ -160,14 +182,7 @@ def fixArticle6(_figure_info: dict[str, list], photo_source: list) -> dict[str,
     
     # Indentifier for the split: <<Name>> <<Number>>|[Number], 'field photograph' <<Name>> et al. ,
     # ''photograph', <<Name>> <<CAPITAL>>-<<Number>> <<Name>> s.n. 
-    patterns = [
-                '([A-Z][a-zêô]+)+ \[?[0-9]+\]?.*', # '<<Names>> <[Number]>...'
-                'field photograph.*', # 'field photograph ...'
-                '([A-Z][a-zêô]+)+ et al\..*', # <<Names>> et al. ...'
-                'photograph.*', # photograph ...
-                '[A-Z][a-z]+ [A-Z]+-[0-9]+.*', # <<Name>> <<CAPITAL>>-<<Number>>
-                '[A-Z][a-zé]+ s\.n\..*', # <<Name>> s.n.
-                ]
+    patterns = ARTICLE6_COLLECTIONS
     
     figure_info = _figure_info.copy()
     for key in figure_info:
@@ -193,58 +208,179 @@ def fixArticle6(_figure_info: dict[str, list], photo_source: list) -> dict[str,
     return figure_info
         
     
-def figures2DataFrame(figures: list):
+# Columns of the DataFrame built by figures2DataFrame
+INDEX_NAMES = ['Figure ID', 'Segment']
+DATAFRAME_COLUMNS = ['Label', 'Taxon Name', 'General Description', 'Caption Text','Url',\
+                     'Specific Description', 'Collection', 'Height', 'Photo Credit']
+# Columns of the figure and segment tables built by figures2Tables
+FIGURE_COLUMNS = DATAFRAME_COLUMNS[:5]
+SEGMENT_COLUMNS = DATAFRAME_COLUMNS[5:]
+# Figures segmented and classified at a time
+FIGURE_CHUNK = 1000
+# Rows of each DataFrame yielded by figures2DataFrames
+BATCH_ROWS = 100000
+
+def iterFigureRows(figures, cache=None, chunk_size: int = FIGURE_CHUNK, skip_unsegmented: bool = False,
+                   article_id: int = 0):
     '''
-    Returns a DataFrame created from a list of figures with 8 columns
-    given below and multi-index of level 2.
+    Yields (figure_info, general_data, rows) for every figure (FigureRecord)
+    of figures, which can be any iterable, rows being the figureInfo2NumpyArray
+    array of the figure. The captions of chunk_size figures are segmented at
+    a time, and their attributes classified all at once.
+    If a cacheFunctions.CaptionCache is given, captions parsed before are read from it.
+    If skip_unsegmented, a figure whose caption cannot be segmented (or whose
+    segments do not fit the columns) has no rows rather than raising, so the
+    figures after it keep their Figure ID.
+    article_id is passed to figureInfo2NumpyArray for every figure: 6 applies
+    the special processing of that article (fixArticle6) to all of them.
+    If article_id is None, the number of each figure (from 1) is passed
+    instead, as figures2DataFrame has always done.
     '''
-    multi_indexes = []
-    
-    # Description, Collection, Height, Photo Credit/Source
-    specific_data = []
-    
+    getSegmentedText = cache.getSegmentedText if cache is not None else figureFunctions.getSegmentedText
+    def segment(figure):
+        try:
+            return getSegmentedText(figure)
+        except (IndexError, ValueError):
+            if not skip_unsegmented:
+                raise
+            return {}, []
 
+    figures = iter(figures)
+    figure_id = 1
+    while chunk := list(islice(figures, chunk_size)):
+        if cache is not None:
+            cache.prefetch(chunk)
+        segmented = [segment(figure) for figure in chunk]
 
-   
-    for i, figure in enumerate(figures):
-        figure_dict, photo_source = figureFunctions.getSegmentedText(figure)
-        
-        # Label, Taxon Name, Description, Caption Text, Link
-        general_data = [figureFunctions.getLabel(figure),\
-                        figureFunctions.getTaxonName(figure),\
-                        figureFunctions.getDescription(figure),\
-                        figureFunctions.getCaptionText(figure),\
-                        figureFunctions.getUrl(figure),\
-                        ]
-        
-        # Array of Description, Collection, Height, Photo Credit/Source
-        specific_arr = figureInfo2NumpyArray(figure_dict, photo_source, general_data, article_id=i+1)
-        specific_data.append(specific_arr)
-        
-        
-        multi_index = figureInfo2MultiIndex(figure_dict, i+1)
-        multi_indexes.append(multi_index)
-    # TODO: Suan specific data da 1A 1B ama general data 1, 2, 3
-    all_data = np.concatenate((specific_data), axis=0)
-    
-    multi_indexes = np.concatenate(multi_indexes, axis=0)
+        texts = pd.unique(pd.Series([text for figure_dict, _ in segmented for attributes in figure_dict.values()
+                                     for text in attributes], dtype=object))
+        text_indexes = dict(zip(texts, text2Indexes(texts).tolist()))
 
-    index = pd.MultiIndex.from_arrays(multi_indexes.T, names=['Figure ID', 'Segment'])
-    
-    columns = ['Label', 'Taxon Name', 'General Description', 'Caption Text','Url',\
-               'Specific Description', 'Collection', 'Height', 'Photo Credit']
+        for figure, (figure_dict, photo_source) in zip(chunk, segmented):
+            # Label, Taxon Name, Description, Caption Text, Link
+            general_data = [figure.label,\
+                            figure.taxon_name,\
+                            figure.description,\
+                            figure.caption_text,\
+                            figure.url,\
+                            ]
+            # Array of general_data, Description, Collection, Height, Photo Credit/Source
+            try:
+                rows = figureInfo2NumpyArray(figure_dict, photo_source, general_data,
+                                             article_id=figure_id if article_id is None else article_id,
+                                             text_indexes=text_indexes)
+            except (IndexError, ValueError):
+                if not skip_unsegmented:
+                    raise
+                figure_dict, rows = {}, figureInfo2NumpyArray({}, [], general_data)
+            yield figure_dict, general_data, rows
+            figure_id += 1
 
-    df = pd.DataFrame(data=all_data, index=index, columns=columns)
-    return df
+class SegmentColumns:
+    '''
+    The rows of figures2DataFrame, appended figure by figure to growable
+    lists, from which the DataFrame is created once, without concatenating
+    per figure arrays. The general data of a figure is kept once, not once
+    per segment, so that it can also be written as a separate figure table.
+    '''
+    def __init__(self):
+        self.figure_ids = []
+        self.figure_columns = [[] for _ in FIGURE_COLUMNS]
+        # Number of segments of each figure
+        self.counts = []
+        self.index = [[] for _ in INDEX_NAMES]
+        self.segment_columns = [[] for _ in SEGMENT_COLUMNS]
+
+    def __len__(self) -> int:
+        return len(self.index[0])
+
+    def append(self, figure_info: dict[str, list], figure_id: int, general_data: list, rows) -> None:
+        '''Appends the figure with figure_id, its general_data and rows (figureInfo2NumpyArray)'''
+        keys = [key for _, key in figureInfo2MultiIndex(figure_info, figure_id)]
+        # Figure IDs are strings, as they have always been in the index
+        self.figure_ids.append(str(figure_id))
+        for column, value in zip(self.figure_columns, general_data):
+            column.append(value)
+        self.counts.append(len(keys))
+        self.index[0].extend([str(figure_id)] * len(keys))
+        self.index[1].extend(keys)
+        for column, values in zip(self.segment_columns, rows[:, len(FIGURE_COLUMNS):].T.tolist()):
+            column.extend(values)
+
+    def toTables(self) -> (pd.DataFrame, pd.DataFrame):
+        '''Returns the figure table (indexed by Figure ID) and the segment table (indexed by Figure ID, Segment)'''
+        figure_table = pd.DataFrame(dict(zip(FIGURE_COLUMNS, self.figure_columns)),
+                                    index=pd.Index(self.figure_ids, name=INDEX_NAMES[0]))
+        segment_table = pd.DataFrame(dict(zip(SEGMENT_COLUMNS, self.segment_columns)),
+                                     index=pd.MultiIndex.from_arrays(self.index, names=INDEX_NAMES))
+        return figure_table, segment_table
+
+    def toDataFrame(self) -> pd.DataFrame:
+        # The general data of each figure repeated for each of its segments
+        positions = np.repeat(np.arange(len(self.counts)), self.counts)
+        columns = {name: np.array(column, dtype=object)[positions]
+                   for name, column in zip(FIGURE_COLUMNS, self.figure_columns)}
+        columns.update(zip(SEGMENT_COLUMNS, self.segment_columns))
+        index = pd.MultiIndex.from_arrays(self.index, names=INDEX_NAMES)
+        return pd.DataFrame(columns, index=index)
+
+def figures2Columns(figures, cache=None, article_id: int = None) -> SegmentColumns:
+    columns = SegmentColumns()
+    figure_rows = iterFigureRows(figures, cache, article_id=article_id)
+    for figure_id, (figure_info, general_data, rows) in enumerate(figure_rows, 1):
+        columns.append(figure_info, figure_id, general_data, rows)
+    return columns
+
+def figures2DataFrame(figures: list, cache=None, article_id: int = None):
+    '''
+    Returns a DataFrame created from a list of figures (FigureRecord) with
+    9 columns given below and multi-index of level 2.
+    If a cacheFunctions.CaptionCache is given, captions parsed before are read from it.
+    article_id is that of the article of the figures, see iterFigureRows:
+    by default each figure is passed its own number, so the 6th one gets
+    the special processing of article 6.
+    '''
+    return figures2Columns(figures, cache, article_id).toDataFrame()
+
+def figures2Tables(figures: list, cache=None, article_id: int = None) -> (pd.DataFrame, pd.DataFrame):
+    '''
+    Returns the data of figures2DataFrame as two tables joined by Figure ID,
+    so that the general data of a figure is stored once rather than for each
+    of its segments: the figure table (Label, Taxon Name, General Description,
+    Caption Text, Url) of every figure and the segment table (Specific
+    Description, Collection, Height, Photo Credit) of every segment
+    '''
+    return figures2Columns(figures, cache, article_id).toTables()
+
+def tables2DataFrame(figure_table: pd.DataFrame, segment_table: pd.DataFrame) -> pd.DataFrame:
+    '''Joins the tables of figures2Tables into the DataFrame of figures2DataFrame'''
+    return segment_table.join(figure_table, on=INDEX_NAMES[0])[DATAFRAME_COLUMNS]
+
+def figures2DataFrames(figures, batch_rows: int = BATCH_ROWS, cache=None, skip_unsegmented: bool = False,
+                       article_id: int = 0):
+    '''
+    Yields the DataFrame of figures2DataFrame in batches of at least
+    batch_rows rows (the last one excepted), keeping a figure's rows in the
+    same batch, for figures (any iterable) too many to hold in memory at once
+    '''
+    columns = SegmentColumns()
+    figure_rows = iterFigureRows(figures, cache, skip_unsegmented=skip_unsegmented, article_id=article_id)
+    for figure_id, (figure_info, general_data, rows) in enumerate(figure_rows, 1):
+        columns.append(figure_info, figure_id, general_data, rows)
+        if len(columns) >= batch_rows:
+            yield columns.toDataFrame()
+            columns = SegmentColumns()
+    if len(columns):
+        yield columns.toDataFrame()
 
-def df2Excel(figures: list, output_file: str, file_name: str) -> None:
+def df2Excel(figures: list, output_file: str, file_name: str, cache=None, article_id: int = None) -> None:
     '''
     Writes figures into properly formatted excel file with
     file_name output_file\plant-data.xlsx
     '''
     if not figures:
         return
-    df = figures2DataFrame(figures)
+    df = figures2DataFrame(figures, cache, article_id)
     path = os.path.join(output_file, file_name)
     
     df.to_excel(path, index=True)
@@ -0,0 +1,103 @@
+import re
+from functools import lru_cache
+
+class MarkerMatcher:
+    '''
+    Finds which of a list of literal markers occur in a text with a single
+    scan of the text, instead of one `in` test per marker: the markers are
+    combined into one regular expression alternation.
+    '''
+    def __init__(self, markers: list):
+        self.markers = list(markers)
+        # Longest first, so that of two markers starting at the same position the longer one is found
+        alternation = '|'.join(re.escape(marker) for marker in sorted(set(self.markers), key=len, reverse=True))
+        if self.canOverlap():
+            # Look for a marker at every position, so that one inside another is found as well
+            self.pattern = re.compile('(?=(' + alternation + '))')
+        else:
+            self.pattern = re.compile('(' + alternation + ')')
+        # Marker -> the other markers it starts with, which occur wherever it does
+        self.prefixes = {marker: [other for other in self.markers if other != marker and marker.startswith(other)]
+                         for marker in self.markers}
+
+    def canOverlap(self) -> bool:
+        '''True if an occurrence of a marker can start inside an occurrence of another'''
+        for marker in self.markers:
+            for other in self.markers:
+                if other != marker and (other in marker[1:] or
+                                        any(marker.endswith(other[:k]) for k in range(1, len(other)))):
+                    return True
+        return False
+
+    def found(self, text: str) -> set:
+        '''Returns the markers that occur in text'''
+        found = set()
+        for marker in self.pattern.findall(text):
+            if marker not in found:
+                found.add(marker)
+                found.update(self.prefixes[marker])
+        return found
+
+    def last(self, text: str, default: str = None) -> str:
+        '''Returns the marker occurring in text which comes last in the list of markers, or default'''
+        found = self.found(text)
+        if found:
+            for marker in reversed(self.markers):
+                if marker in found:
+                    return marker
+        return default
+
+# All the patterns used to parse captions, compiled once at import
+
+# figureFunctions
+# Height data labelled [BOLD_LETTER] = [DATA], eg A = 5 cm
+SCALE_BAR_LETTER = re.compile(r'[A-Z] = [0-9] [cm]m')
+# Collector and number of herbarium specimens, most specific first
+SPECIMEN_COLLECTIONS = [re.compile(r'[A-ZØ][a-zñ]+ & [A-Z][a-zñ]+ [0-9]+'),
+                        re.compile(r'[A-Z][a-zñ]+ [0-9]+'),
+                        re.compile(r'\([A-Z].*et al.*\)'),
+                        re.compile(r'[A-Z][a-zñ]+ et al.*\)'),
+                        re.compile(r'[A-Z][a-zñ]+ s.n.'),
+                        ]
+SPECIMEN_ACCESSION = re.compile(r'[A-Z][a-z]+ [A-Z]+-[0-9]+')
+# Collector and number of the illustrated plant, most specific first
+ILLUSTRATION_COLLECTIONS = [re.compile(r'[A-Z][.] [A-Z][a-z]+ [0-9]+'),
+                            re.compile(r'[A-Z][a-z]+ & [A-Z][a-z]+ [0-9]+'),
+                            re.compile(r'[A-Z][a-z]+ [0-9]+'),
+                            ]
+# Possible end lines of the caption, ie the start of the photo/drawing source.
+# These are found and ordered via manual checking: the last one found in the text is used.
+END_LINES = MarkerMatcher(['Photograph credits: ', 'permission of ', 'Drawn by ', 'Drawn By ',
+                           'Adapted from ', 'Reproduced from ',
+                           'Illustration by ', 'Drawing by ',
+                           'Courtesy of ', 'Photos By ', 'Photos by'])
+
+# helperFunctions
+# Label letters that are not bold, eg 'A-C '
+MISPLACED_LETTER_RANGE = re.compile(r'[A-Za-z]-[A-Za-z]\s')
+
+@lru_cache(maxsize=None)
+def misplacedLetterPattern(max_letter: str):
+    '''Returns the pattern of a non-bold label letter from A to max_letter, eg 'C, ' '''
+    return re.compile(f'[A-{max_letter}],*\\s')
+
+# pandasFunctions
+# Description - predicted to start and end with space and consist of letters
+DESCRIPTION_TEXT = re.compile(r'^\s[^0-9]*\s$')
+HERBARIUM_SPECIMEN_TEXT = re.compile(r'(\s)?Herbarium specimen .*')
+# Height - always int|float mm|cm
+HEIGHT_TEXT = re.compile(r'[0-9]+(\.)?[0-9]* [cm]m')
+# The three above as one pattern, for a single match per text: alternatives are
+# tried in order, so the first of them that matches is the one that is found
+SEGMENT_FIELD = re.compile('|'.join('(?P<{}>{})'.format(name, pattern.pattern) for name, pattern in
+                                    [('description', DESCRIPTION_TEXT), ('herbarium', HERBARIUM_SPECIMEN_TEXT),
+                                     ('height', HEIGHT_TEXT)]))
+# Collection data within the description of article 6, see pandasFunctions.fixArticle6
+ARTICLE6_COLLECTIONS = [
+                        re.compile(r'([A-Z][a-zêô]+)+ \[?[0-9]+\]?.*'), # '<<Names>> <[Number]>...'
+                        re.compile(r'field photograph.*'), # 'field photograph ...'
+                        re.compile(r'([A-Z][a-zêô]+)+ et al\..*'), # <<Names>> et al. ...'
+                        re.compile(r'photograph.*'), # photograph ...
+                        re.compile(r'[A-Z][a-z]+ [A-Z]+-[0-9]+.*'), # <<Name>> <<CAPITAL>>-<<Number>>
+                        re.compile(r'[A-Z][a-zé]+ s\.n\..*'), # <<Name>> s.n.
+                        ]
@@ -0,0 +1,7 @@
+import os
+
+def availableCores() -> int:
+    '''Returns the number of cores this process may run on, ie the default number of worker processes'''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
@@ -0,0 +1,343 @@
+import json
+import os
+from collections import deque
+
+from lxml import etree
+
+from functions.compressionFunctions import articleSource, articleStem
+from functions.figureFunctions import FigureRecord
+
+# Whitespace-only strings made of these characters are collapsed by BeautifulSoup
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
+def localName(elem) -> str:
+    return elem.tag.rpartition('}')[2]
+
+def tagName(elem) -> str:
+    '''Returns the name of the element as BeautifulSoup reports it, ie prefix:localname'''
+    localname = localName(elem)
+    return elem.prefix + ':' + localname if elem.prefix else localname
+
+def matchesName(elem, name: str) -> bool:
+    '''
+    True if BeautifulSoup find(name) would match the element: name is
+    either the local name ('label') or the prefixed name ('tp:nomenclature')
+    '''
+    if not isinstance(elem.tag, str):
+        return False
+    localname = localName(elem)
+    return localname == name or (elem.prefix is not None and elem.prefix + ':' + localname == name)
+
+def findFirst(elem, name: str):
+    '''Returns the first descendant of elem matching name in document order, like Tag.find'''
+    for descendant in elem.iterdescendants():
+        if matchesName(descendant, name):
+            return descendant
+    return None
+
+def normaliseString(text: str) -> str:
+    '''BeautifulSoup replaces whitespace-only strings by a single newline or space'''
+    if text and not text.strip(ASCII_SPACES):
+        return '\n' if '\n' in text else ' '
+    return text
+
+def iterStrings(elem):
+    '''Yields the text nodes of elem in document order, skipping comments, like Tag.strings'''
+    if elem.text:
+        yield normaliseString(elem.text)
+    for child in elem:
+        if isinstance(child.tag, str):
+            yield from iterStrings(child)
+        if child.tail:
+            yield normaliseString(child.tail)
+
+def getText(elem) -> str:
+    '''Equivalent of Tag.text'''
+    return ''.join(iterStrings(elem))
+
+def getContentsText(elem) -> str:
+    '''Equivalent of ' '.join([e.text for e in tag.contents]), comments having empty text'''
+    contents = []
+    if elem.text:
+        contents.append(normaliseString(elem.text))
+    for child in elem:
+        contents.append(getText(child) if isinstance(child.tag, str) else '')
+        if child.tail:
+            contents.append(normaliseString(child.tail))
+    return ' '.join(contents)
+
+def escapeText(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def quoteAttribute(value: str) -> str:
+    '''Quotes an attribute value the way BeautifulSoup's minimal formatter does'''
+    value = escapeText(value)
+    if '"' not in value:
+        return '"' + value + '"'
+    if "'" not in value:
+        return "'" + value + "'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+def attributeName(elem, name: str) -> str:
+    if not name.startswith('{'):
+        return name
+    qname = etree.QName(name)
+    if qname.namespace == XML_NAMESPACE:
+        return 'xml:' + qname.localname
+    for prefix, namespace in elem.nsmap.items():
+        if namespace == qname.namespace and prefix is not None:
+            return prefix + ':' + qname.localname
+    return qname.localname
+
+def serialise(elem, declarations: dict, parts: list) -> None:
+    '''
+    Appends the markup of elem to parts exactly as str() of the equivalent
+    BeautifulSoup Tag would produce it. declarations maps elements to the
+    namespaces declared on them, which BeautifulSoup keeps as attributes.
+    '''
+    if not isinstance(elem.tag, str):
+        if elem.tag is etree.Comment:
+            parts.append('<!--' + elem.text + '-->')
+        elif elem.tag is etree.ProcessingInstruction:
+            parts.append('<?' + elem.target + (' ' + elem.text if elem.text else '') + '?>')
+        return
+
+    name = tagName(elem)
+    parts.append('<' + name)
+    attributes = [(attributeName(elem, key), value) for key, value in elem.attrib.items()]
+    attributes += [('xmlns:' + prefix if prefix else 'xmlns', namespace)
+                   for prefix, namespace in declarations.get(elem, ())]
+    # BeautifulSoup writes attributes in alphabetical order
+    for key, value in sorted(attributes):
+        parts.append(' ' + key + '=' + quoteAttribute(value))
+
+    if not elem.text and len(elem) == 0:
+        parts.append('/>')
+        return
+    parts.append('>')
+    if elem.text:
+        parts.append(escapeText(normaliseString(elem.text)))
+    for child in elem:
+        serialise(child, declarations, parts)
+        if child.tail:
+            parts.append(escapeText(normaliseString(child.tail)))
+    parts.append('</' + name + '>')
+
+def getTaxonNameText(nomenclature) -> str:
+    '''Equivalent of figureFunctions.getTaxonName given the tp:nomenclature element'''
+    taxon_name = findFirst(nomenclature, 'tp:taxon-name')
+    if taxon_name is None:
+        return None
+    parts = [part for part in taxon_name.iterdescendants() if matchesName(part, 'tp:taxon-name-part')]
+    return ' '.join([getText(part) for part in parts])
+
+# Elements whose content figures take from their parent (p, title) and grandparent (tp:nomenclature)
+CONTEXT_NAMES = ('p', 'title', 'tp:nomenclature')
+CONTEXT_TEXT = {'p': getContentsText, 'title': getText, 'tp:nomenclature': getTaxonNameText}
+
+def contextName(elem) -> str:
+    '''Returns which of CONTEXT_NAMES the element matches, if any'''
+    for name in CONTEXT_NAMES:
+        if matchesName(elem, name):
+            return name
+    return None
+
+class OpenElement:
+    '''Parsing state of an element whose end tag has not been reached yet'''
+    __slots__ = ('element', 'figure', 'first', 'text', 'closed', 'keep')
+
+    def __init__(self, element):
+        self.element = element
+        self.figure = matchesName(element, 'fig')
+        # Context name -> first descendant element with that name
+        self.first = {}
+        # Context name -> text of that descendant, once it is complete
+        self.text = {}
+        self.closed = False
+        # Whether the content of the element is still needed
+        self.keep = False
+
+    def isResolved(self, name: str) -> bool:
+        return name in self.text or (self.closed and name not in self.first)
+
+def iterparseArticle(input_file: str, events: tuple):
+    '''etree.iterparse of an article, decompressing it as it is read if it is compressed'''
+    with articleSource(input_file) as source:
+        yield from etree.iterparse(source, events=events, recover=True)
+
+def iterFigureRecords(input_file: str, positions: set = None):
+    '''
+    Streams the <fig> elements of an XML article with lxml iterparse and
+    yields a FigureRecord per figure, in document order, identical to the
+    one figureFunctions.figure2Record builds from the BeautifulSoup tree.
+    If positions is given, only the figures at those positions (see
+    buildSectionIndex) are extracted, the others are skipped.
+    Parsed subtrees are freed as soon as no figure needs them any more.
+    '''
+    stack = []
+    # Context element -> open elements whose first descendant it is
+    waiting = {}
+    # Figures waiting for context that comes later in the document
+    pending = deque()
+    declarations = {}
+    new_declarations = []
+    keep_depth = 0
+    position = 0
+
+    events = iterparseArticle(input_file, ('start-ns', 'start', 'end'))
+    for event, elem in events:
+        if event == 'start-ns':
+            new_declarations.append(elem)
+            continue
+
+        if event == 'start':
+            if new_declarations:
+                declarations[elem] = new_declarations
+                new_declarations = []
+            current = OpenElement(elem)
+            if current.figure:
+                current.figure = positions is None or position in positions
+                position += 1
+            name = contextName(elem)
+            if name is not None:
+                for ancestor in reversed(stack):
+                    if name in ancestor.first:
+                        break
+                    ancestor.first[name] = elem
+                    waiting.setdefault(elem, (name, []))[1].append(ancestor)
+            if elem in waiting or current.figure:
+                current.keep = True
+                keep_depth += 1
+            stack.append(current)
+            continue
+
+        current = stack.pop()
+        current.closed = True
+        if current.keep:
+            keep_depth -= 1
+
+        if elem in waiting:
+            name, ancestors = waiting.pop(elem)
+            text = CONTEXT_TEXT[name](elem)
+            for ancestor in ancestors:
+                ancestor.text[name] = text
+
+        if current.figure:
+            parent = stack[-1] if stack else None
+            grandparent = stack[-2] if len(stack) > 1 else None
+            label, url, caption = findFirst(elem, 'label'), findFirst(elem, 'uri'), findFirst(elem, 'caption')
+            caption_p = findFirst(caption, 'p') if caption is not None else None
+            paragraph = findFirst(elem, 'p')
+            strings = list(iterStrings(paragraph)) if paragraph is not None else []
+            parts = []
+            serialise(elem, declarations, parts)
+            pending.append((parent, grandparent, FigureRecord(
+                label=getText(label).replace('.', '') if label is not None else None,
+                url=getText(url) if url is not None else None,
+                caption_text=getContentsText(caption_p) if caption_p is not None else None,
+                xml=''.join(parts),
+                text=''.join(strings),
+                strings=strings,
+                bolds=[getText(bold) for bold in elem.iterdescendants() if matchesName(bold, 'bold')],
+            )))
+
+        while pending:
+            parent, grandparent, record = pending[0]
+            if parent is not None and not (parent.isResolved('p') and parent.isResolved('title')):
+                break
+            if grandparent is not None and not grandparent.isResolved('tp:nomenclature'):
+                break
+            pending.popleft()
+            title = parent.text.get('title') if parent is not None else None
+            record.section = title.replace('.', '') if title is not None else None
+            record.description = parent.text.get('p') if parent is not None else None
+            record.taxon_name = grandparent.text.get('tp:nomenclature') if grandparent is not None else None
+            yield record
+
+        if keep_depth == 0:
+            # Nothing still open needs this subtree: free it, with its finished siblings
+            elem.clear(keep_tail=True)
+            declarations.pop(elem, None)
+            parent_elem = elem.getparent()
+            if parent_elem is not None:
+                while elem.getprevious() is not None:
+                    del parent_elem[0]
+
+def buildSectionIndex(input_file: str) -> dict:
+    '''
+    Returns the position (in document order, counting from 0) of every
+    <fig> of the article, grouped by the title of the section it is in,
+    ie by the key figureFunctions.figureSegmentation would give it.
+    Only the section titles are read, the figures themselves are not
+    extracted, so this is much cheaper than iterFigureRecords.
+    Figures whose section has no title are left out.
+    '''
+    index = {}
+    # Open elements: [figure positions among the children, first title descendant, its text]
+    stack = []
+    position = 0
+    title_depth = 0
+
+    for event, elem in iterparseArticle(input_file, ('start', 'end')):
+        if event == 'start':
+            if matchesName(elem, 'fig'):
+                if stack:
+                    stack[-1][0].append(position)
+                position += 1
+            elif matchesName(elem, 'title'):
+                title_depth += 1
+                for ancestor in reversed(stack):
+                    if ancestor[1] is not None:
+                        break
+                    ancestor[1] = elem
+            stack.append([[], None, None])
+            continue
+
+        figures, title, text = stack.pop()
+        if title_depth and matchesName(elem, 'title'):
+            title_depth -= 1
+            text = getText(elem).replace('.', '')
+            for ancestor in stack:
+                if ancestor[1] is elem:
+                    ancestor[2] = text
+        if figures and title is not None:
+            index.setdefault(text, []).extend(figures)
+
+        if title_depth == 0:
+            elem.clear(keep_tail=True)
+            parent_elem = elem.getparent()
+            if parent_elem is not None:
+                while elem.getprevious() is not None:
+                    del parent_elem[0]
+
+    for positions in index.values():
+        positions.sort()
+    return index
+
+def sectionIndexPath(input_file: str) -> str:
+    '''Returns where the section index of an article is stored, next to the article'''
+    return articleStem(input_file) + '.sections.json'
+
+def loadSectionIndex(input_file: str) -> dict:
+    '''
+    Returns buildSectionIndex(input_file), read from the stored index if the
+    article has not changed since it was built, so that later stages (and
+    later runs) do not need to parse the article again to find its sections
+    '''
+    stat = os.stat(input_file)
+    index_path = sectionIndexPath(input_file)
+    try:
+        with open(index_path, 'r', encoding='utf8') as f_in:
+            stored = json.load(f_in)
+        if stored['size'] == stat.st_size and stored['mtime_ns'] == stat.st_mtime_ns:
+            return stored['sections']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Imported here, as the caption stage reads figures with this module without needing the HTTP stack
+    from functions.httpFunctions import writeAtomic
+    index = buildSectionIndex(input_file)
+    stored = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sections': index}
+    writeAtomic(index_path, json.dumps(stored, ensure_ascii=False).encode('utf8'))
+    return index
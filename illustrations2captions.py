@@ -1,10 +1,248 @@
 import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
-def main(inputfile, outputfile, do_special_processing=False):
+from functions.cacheFunctions import CAPTION_CACHE, CaptionCache, cacheStatistics
+from functions.datasetFunctions import DATASET_FORMATS, figures2Dataset, importArrow
+from functions.figureFunctions import FigureRecord
+from functions.figureStoreFunctions import FigureStore, figureStorePath, isReference, openFigureStore
+import functions.figureFunctions as figureFunctions
+import functions.lxmlFunctions as lxmlFunctions
+from functions.pandasFunctions import FIGURE_COLUMNS, INDEX_NAMES, SEGMENT_COLUMNS, figureInfo2MultiIndex, \
+    figureInfo2NumpyArray, text2Indexes
+from functions.processFunctions import availableCores
+
+# Columns of species-descriptions.txt, as written by xml2illustrationdata.py
+INPUT_COLUMNS = ['Label', 'Taxon Name', 'Description', 'Url', 'Figure Object']
+# Columns of captions.txt: one row per segment (panel) of each figure, ie the segment table of
+# pandasFunctions.figures2Tables. species-descriptions.txt is the figure table: Figure ID n is its nth figure.
+OUTPUT_COLUMNS = INDEX_NAMES + SEGMENT_COLUMNS
+# Figures handed to a worker at a time
+CHUNK_SIZE = 64
+# Chunks in flight per worker: this bounds memory, as results waiting to be written in order are kept in memory
+CHUNKS_PER_WORKER = 4
+# Caption cache and figure store of a worker process, see initCaptionWorker
+WORKER_CACHE = None
+WORKER_STORE = None
+
+def readRows(f_in):
+    '''
+    Yields the fields of each figure of species-descriptions.txt, one line
+    at a time. Only the figure markup has its newlines removed when written,
+    so a row with too few fields continues on the next line.
+    '''
+    f_in.readline()
+    row = []
+    for line in f_in:
+        fields = line.rstrip('\n').split('\t')
+        if row:
+            row[-1] += '\n' + fields[0]
+            fields = fields[1:]
+        row += fields
+        if len(row) >= len(INPUT_COLUMNS):
+            yield row
+            row = []
+    if row:
+        yield row + [''] * (len(INPUT_COLUMNS) - len(row))
+
+def row2Record(row: list, store: FigureStore = None) -> FigureRecord:
+    '''
+    Returns the FigureRecord of a row of species-descriptions.txt, parsing its
+    caption from the figure markup, read from store if the row refers to it
+    '''
+    label, taxon_name, description, url, markup = row[:len(INPUT_COLUMNS)]
+    if isReference(markup):
+        if store is None:
+            raise ValueError('Figure {} is in a figure store, which was not found'.format(label))
+        markup = store.read(markup)
+    figure = lxmlFunctions.parseFigure(markup)
+    return FigureRecord(label=label or None, taxon_name=taxon_name or None, description=description or None,
+                        caption_text=lxmlFunctions.getCaptionText(figure), url=url or None, xml=markup,
+                        text=lxmlFunctions.getParagraphText(figure), strings=lxmlFunctions.getStrings(figure),
+                        bolds=lxmlFunctions.getBolds(figure))
+
+def cleanField(value) -> str:
+    '''Tabs and newlines would split the field, so they are replaced by spaces'''
+    return '' if value is None else str(value).replace('\t', ' ').replace('\n', ' ')
+
+def segmentRows(first_id: int, rows: list, do_special_processing: bool = False) -> (list, int, int, int):
+    '''
+    Segments the captions of rows, the first one having Figure ID first_id.
+    Returns the lines of captions.txt for them, with the number of caption
+    cache hits and misses, and of captions that could not be segmented.
+    '''
+    cache = WORKER_CACHE
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    records = [row2Record(row, WORKER_STORE) for row in rows]
+    if cache is not None:
+        cache.prefetch(records)
+
+    segmented = []
+    for figure in records:
+        try:
+            if cache is not None:
+                segmented.append(cache.getSegmentedText(figure))
+            else:
+                segmented.append(figureFunctions.getSegmentedText(figure))
+        except (IndexError, ValueError):
+            segmented.append(None)
+    # Every attribute of the chunk is classified at once
+    texts = [text for result in segmented if result is not None for attributes in result[0].values()
+             for text in attributes]
+    text_indexes = dict(zip(texts, text2Indexes(texts).tolist()))
+
+    lines = []
+    failures = 0
+    for figure_id, (figure, result) in enumerate(zip(records, segmented), first_id):
+        general_data = [figure.label, figure.taxon_name, figure.description, figure.caption_text, figure.url]
+        try:
+            if result is None or not result[0]:
+                raise ValueError('The caption could not be segmented')
+            figure_info, photo_source = result
+            # The special processing is the one pandasFunctions applies to article 6
+            data = figureInfo2NumpyArray(figure_info, photo_source, general_data,
+                                         article_id=6 if do_special_processing else 0, text_indexes=text_indexes)
+            indexes = figureInfo2MultiIndex(figure_info, figure_id)
+        except (IndexError, ValueError):
+            # Captions the parser cannot segment are kept, as a single row without segment data
+            failures += 1
+            data = [general_data + [''] * len(SEGMENT_COLUMNS)]
+            indexes = [(figure_id, '')]
+        for index, values in zip(indexes, data):
+            # The general data is in species-descriptions.txt already
+            lines.append('\t'.join(cleanField(value) for value in list(index) + list(values[len(FIGURE_COLUMNS):]))
+                         + '\n')
+
+    if cache is None:
+        return lines, 0, 0, failures
+    cache.flush()
+    return lines, cache.hits - hits, cache.misses - misses, failures
+
+def initCaptionWorker(cache_path, store_path=None):
+    '''Opens the caption cache and figure store of a worker process once, before it segments its first chunk'''
+    global WORKER_CACHE, WORKER_STORE
+    WORKER_CACHE = CaptionCache(cache_path) if cache_path else None
+    WORKER_STORE = FigureStore(store_path) if store_path else None
+
+def iterChunks(rows, chunk_size: int):
+    '''Yields (Figure ID of the first row, list of rows) chunks of at most chunk_size rows'''
+    first_id = 1
+    while chunk := list(islice(rows, chunk_size)):
+        yield first_id, chunk
+        first_id += len(chunk)
+
+def orderedResults(executor, chunks, do_special_processing: bool, window: int):
+    '''
+    Segments chunks in the worker pool and yields their results in input
+    order, keeping at most window chunks in flight: the result of a chunk
+    that finishes early waits in its future until the ones before it are done
+    '''
+    in_flight = deque()
+    for first_id, rows in chunks:
+        in_flight.append(executor.submit(segmentRows, first_id, rows, do_special_processing))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+def dataPath2Doi(inputfile: str, data_prefix: str = 'data/') -> str:
+    '''Returns the DOI of the article of inputfile, data/<doi>/species-descriptions.txt'''
+    return os.path.relpath(os.path.dirname(inputfile), data_prefix).replace(os.sep, '/')
+
+def writeDataset(inputfile, dataset_dir, doi, cache_path=CAPTION_CACHE, file_format='parquet',
+                 do_special_processing=False) -> (int, int, int):
+    '''
+    Writes the figures of inputfile to the partition of the article doi of the
+    Parquet (or Feather) dataset in dataset_dir, see datasetFunctions.figures2Dataset.
+    The captions were just segmented, so they are read from the caption cache,
+    and the figures processed as they were, see segmentRows. Returns the number of rows, and of caption cache hits and misses.
+    '''
+    cache = CaptionCache(cache_path) if cache_path else None
+    store = openFigureStore(inputfile)
+    try:
+        with open(inputfile, 'r', encoding='utf8') as f_in:
+            records = (row2Record(row, store) for row in readRows(f_in))
+            rows = figures2Dataset(records, dataset_dir, doi, cache, file_format, skip_unsegmented=True,
+                                   article_id=6 if do_special_processing else 0)
+    finally:
+        if cache is not None:
+            cache.close()
+        if store is not None:
+            store.close()
+    return rows, (cache.hits if cache else 0), (cache.misses if cache else 0)
+
+def main(inputfile, outputfile, do_special_processing=False, processes=None, cache_path=CAPTION_CACHE,
+         chunk_size=CHUNK_SIZE, dataset_dir=None, doi=None, dataset_format='parquet'):
+    '''
+    Segments the caption of every figure in inputfile (species-descriptions.txt)
+    into its panels and writes them to outputfile (captions.txt).
+    The input is read and the output written a chunk of figures at a time, the
+    chunks being segmented by a pool of worker processes (one per available
+    core by default) and written in input order, so memory use does not grow
+    with the size of the article. The output replaces outputfile only once complete.
+    If dataset_dir is given, the figures are also written to the partition of
+    the article doi (by default, the one of inputfile) of a Parquet/Feather dataset.
+    '''
     print('Parsing captions in {} saving parsed caption data to {}'.format(inputfile, outputfile))
+    if dataset_dir:
+        # Fail before segmenting anything if the dataset cannot be written
+        importArrow()
+    processes = processes or availableCores()
+    start = time.perf_counter()
+    segments = hits = misses = failures = 0
+
+    store_path = figureStorePath(inputfile)
+    store_path = store_path if os.path.exists(store_path) else None
+    part_file = outputfile + '.part'
+    with open(inputfile, 'r', encoding='utf8') as f_in, open(part_file, 'w', encoding='utf8') as f_out:
+        f_out.write('\t'.join(OUTPUT_COLUMNS) + '\n')
+        chunks = iterChunks(readRows(f_in), chunk_size)
+
+        if processes == 1:
+            initCaptionWorker(cache_path, store_path)
+            results = (segmentRows(first_id, rows, do_special_processing) for first_id, rows in chunks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=processes, initializer=initCaptionWorker,
+                                           initargs=(cache_path, store_path))
+            results = orderedResults(executor, chunks, do_special_processing, processes * CHUNKS_PER_WORKER)
+
+        try:
+            for lines, chunk_hits, chunk_misses, chunk_failures in results:
+                f_out.writelines(lines)
+                segments += len(lines)
+                hits += chunk_hits
+                misses += chunk_misses
+                failures += chunk_failures
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            else:
+                if WORKER_CACHE is not None:
+                    WORKER_CACHE.close()
+                if WORKER_STORE is not None:
+                    WORKER_STORE.close()
+    os.replace(part_file, outputfile)
+
+    print('Wrote {} segments in {:.2f}s with {} processes'.format(segments, time.perf_counter() - start, processes))
+    if dataset_dir:
+        doi = doi or dataPath2Doi(inputfile)
+        rows, dataset_hits, dataset_misses = writeDataset(inputfile, dataset_dir, doi, cache_path, dataset_format,
+                                                          do_special_processing)
+        hits += dataset_hits
+        misses += dataset_misses
+        print('Wrote {} rows of {} to the dataset in {}'.format(rows, doi, dataset_dir))
+    if failures:
+        print('{} captions could not be segmented'.format(failures), file=sys.stderr)
+    if cache_path:
+        print(cacheStatistics(hits, misses))
 
 if __name__ == "__main__":
-    
+
     # Create an ArgumentParser object
     parser = argparse.ArgumentParser(description="Process captions.")
 
@@ -12,8 +250,15 @@ if __name__ == "__main__":
     parser.add_argument("input_file", help="Path to the input txt file")
     parser.add_argument("output_file", help="Path to the output captions file")
     parser.add_argument("--do_special_processing", default=False, action='store_true')
+    parser.add_argument("--processes", type=int, help="Number of worker processes (default: one per core)")
+    parser.add_argument("--caption_cache", default=CAPTION_CACHE, help="Path to the caption cache ('' to disable)")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE, help="Number of figures handed to a worker at a time")
+    parser.add_argument("--dataset_dir", help="Also write the figures to a Parquet/Feather dataset in this directory (needs pyarrow)")
+    parser.add_argument("--doi", help="DOI of the article in the dataset (default: from the input path, data/<doi>/...)")
+    parser.add_argument("--dataset_format", default='parquet', choices=list(DATASET_FORMATS))
     # Parse the command-line arguments
     args = parser.parse_args()
 
     # Call the main function with the provided arguments
-    main(args.input_file, args.output_file, args.do_special_processing)
+    main(args.input_file, args.output_file, args.do_special_processing, args.processes, args.caption_cache,
+         args.chunk_size, args.dataset_dir, args.doi, args.dataset_format)
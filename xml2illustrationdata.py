@@ -1,15 +1,32 @@
 from bs4 import BeautifulSoup
-import requests
 import os
 import argparse
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import sys
 sys.path.append('./functions/figureFunctions')
-from functions.figureFunctions import getLabel, getUrl, getTaxonName, getDescription, figureSegmentation
+from functions.compressionFunctions import articleStem, openArticle
+from functions.figureFunctions import figure2Record
+from functions.figureStoreFunctions import FigureStoreWriter, figureStorePath
+from functions.streamFunctions import iterFigureRecords, loadSectionIndex
+import functions.lxmlFunctions as lxmlFunctions
+from functions.httpFunctions import HTTP_CACHE_DIR, MAX_CONCURRENCY, REQUESTS_PER_SECOND, DownloadQueue, HttpCache, \
+    configureArchive, configureScheduler, createSession, downloadFile, writeChecksum
+from functions.processFunctions import availableCores
+from doi2xml import doi2path, readDois
+
+# Least recently used figure images are evicted once the image cache exceeds this size
+IMAGE_CACHE_MB = 2048
+# Number of figure images downloaded concurrently while the output is being written
+DOWNLOAD_WORKERS = 4
+# Image cache of a corpus worker process, see initCorpusWorker
+WORKER_CACHE = None
     
-def xml2illustrations(input_file, output_file, image_dir, download_images = True):
-    xml_data = None
-    with open(input_file, 'r', encoding = 'utf-8') as f_in:
+def soupFigureRecords(input_file, positions):
+    '''Yields the FigureRecord of each figure at positions, parsing the whole article with BeautifulSoup'''
+    with openArticle(input_file, 'r', encoding = 'utf-8') as f_in:
         
             xml_data = f_in.read()
             
@@ -17,49 +34,165 @@ def xml2illustrations(input_file, output_file, image_dir, download_images = True
             
             all_figures = soup.find_all('fig')
             
-            search_table = figureSegmentation(all_figures)
+            for position in positions:
+                yield figure2Record(all_figures[position])
+
+def lxmlFigureRecords(input_file, positions):
+    '''Yields the FigureRecord of each figure at positions, parsing the whole article with lxml'''
+    all_figures = lxmlFunctions.getFigures(lxmlFunctions.parseArticle(input_file))
+    for position in positions:
+        yield lxmlFunctions.figure2Record(all_figures[position])
+
+def streamedFigureRecords(input_file, positions):
+    '''Yields the FigureRecord of each figure at positions, streaming the article with lxml iterparse'''
+    return iterFigureRecords(input_file, set(positions))
+
+# Ways of reading the figures of an article, which all give identical records
+BACKENDS = {'soup': soupFigureRecords, 'lxml': lxmlFigureRecords, 'streaming': streamedFigureRecords}
+
+def xml2illustrations(input_file, output_file, image_dir, download_images = True, cache = None,
+                      download_workers = DOWNLOAD_WORKERS, backend = 'soup', section = 'Description',
+                      inline_figures = False):
+    '''
+    Writes the figures of the section of input_file to output_file
+    (species-descriptions.txt), one per row. The markup of each figure is
+    kept in a compressed figure store next to it (species-descriptions.figures),
+    the Figure Object column only referring to it, unless inline_figures.
+    '''
+    session = createSession(pool_size=download_workers) if download_images else None
+
+    #Temporary as we are only working on 'Description' tagged figures for now
+    key = section
+    # Only the figures of the requested section are extracted, found with the (stored) section index
+    positions = loadSectionIndex(input_file).get(key, [])
+    figures = BACKENDS[backend](input_file, positions)
+
+    # Figure images are queued as each figure is written and downloaded in the background,
+    # the queue is drained before returning
+    store_path = figureStorePath(output_file)
+    if inline_figures and os.path.exists(store_path):
+        os.remove(store_path)
+    with open(output_file, 'w', encoding='utf8') as f_out, DownloadQueue(download_workers) as downloads, \
+         (nullcontext() if inline_figures else FigureStoreWriter(store_path)) as store:
+        
+        headers = ['Label', 'Taxon Name', 'Description', 'Url', 'Figure Object']
+        f_out.write('\t'.join(headers) + '\n')
+        
+        for figure in figures:
+            
+            figure_object = figure.xml.replace('\n', '')
+            if store is not None:
+                figure_object = store.add(figure.label, figure_object)
+            output_data = [figure.label, figure.taxon_name, figure.description, figure.url, figure_object]
+            
+            output_data = ['' if i is None else i for i in output_data]
+            f_out.write('\t'.join(output_data) + '\n')
             
-            #Temporary as we are only working on 'Description' tagged figures for now
-            key = 'Description'
-            description_figures = search_table.get(key, [])
-                        
-            with open(output_file, 'w', encoding='utf8') as f_out:
+            if download_images:
                 
-                headers = ['Label', 'Taxon Name', 'Description', 'Url', 'Figure Object']
-                f_out.write('\t'.join(headers) + '\n')
+                os.makedirs(image_dir, exist_ok = True)
                 
-                for i, figure in enumerate(description_figures):
+                if figure.url is not None:
                     
-                    output_data = [getLabel(figure), getTaxonName(figure), getDescription(figure), getUrl(figure), str(figure).replace('\n', '')]
+                    figure_label = ''.join(filter(str.isdigit, figure.label))
+                    figure_label = '0' * (3 - len(figure_label)) + figure_label  
                     
-                    output_data = ['' if i is None else i for i in output_data]
-                    f_out.write('\t'.join(output_data) + '\n')
+                    image_file = f'{key}_{figure_label}.jpg'
+                    save_path = os.path.join(image_dir, image_file)
                     
-                    if download_images:
-                        
-                        os.makedirs(image_dir, exist_ok = True)
-                        fig_url = getUrl(figure)
-                        
-                        if fig_url is not None:
-                            
-                            figure_label = ''.join(filter(str.isdigit, getLabel(figure)))
-                            figure_label = '0' * (3 - len(figure_label)) + figure_label  
-                            
-                            image_file = f'{key}_{figure_label}.jpg'
-                            save_path = os.path.join(image_dir, image_file)
-                            
-                            downloadImage(fig_url, save_path)
-            f_out.close()
+                    downloads.submit(downloadImage, figure.url, save_path, session, cache)
 
-        
-# TODO: Use the requests library to download the image specified in fig_url and store the downloaded file in image_dir
+def downloadImage(url, destinationDir, session = None, cache = None):
+    '''
+    Streams the image at url to destinationDir, resuming interrupted transfers,
+    and records its SHA-256 next to it (destinationDir.sha256)
+    '''
+    if session is None:
+        session = createSession(pool_size=1)
+    if cache is not None:
+        # Only downloaded if the image changed since it was cached
+        _, sha256 = cache.fetch(session, url, destinationDir)
+    else:
+        _, sha256 = downloadFile(session, url, destinationDir)
+    writeChecksum(destinationDir, sha256)
+
+def doi2dataPath(doi, data_prefix):
+    '''
+    Returns the output path used by the Makefile for a DOI
+    Example: 10.3897/phytokeys.22.4041 -> data/10.3897/phytokeys.22.4041/species-descriptions.txt
+    '''
+    return os.path.join(data_prefix, doi, 'species-descriptions.txt')
+
+def findDownloadedDois(download_prefix):
+    '''Returns the DOIs of all the articles downloaded into download_prefix, ie the inverse of doi2path'''
+    dois = set()
+    for directory, _, file_names in os.walk(download_prefix):
+        for file_name in file_names:
+            if file_name.endswith(('.xml', '.xml.gz')):
+                path = os.path.relpath(os.path.join(directory, file_name), download_prefix)
+                dois.add(articleStem(path).replace(os.sep, '/'))
+    return sorted(dois)
+
+def initCorpusWorker(requests_per_second, http_archive, archive_mode, cache_dir, image_cache_mb, processes):
+    '''Configures a corpus worker process once, before it processes its first article'''
+    global WORKER_CACHE
+    # The rate and concurrency limits apply to the whole corpus run, so they are shared out between the processes
+    configureScheduler(rate=requests_per_second / processes, max_concurrency=max(1, MAX_CONCURRENCY // processes))
+    if http_archive:
+        configureArchive(http_archive, archive_mode)
+    if cache_dir:
+        WORKER_CACHE = HttpCache(os.path.join(cache_dir, 'images'), max_bytes=image_cache_mb * 1024 * 1024)
+
+def corpusArticle(input_file, output_file, download_images, download_workers, backend, section,
+                  inline_figures = False):
+    '''Processes one article of a corpus in a worker process, returns the time it took in seconds'''
+    start = time.perf_counter()
+    image_dir = os.path.dirname(output_file)
+    os.makedirs(image_dir, exist_ok = True)
+    xml2illustrations(input_file, output_file, image_dir, download_images, WORKER_CACHE, download_workers, backend,
+                      section, inline_figures)
+    return time.perf_counter() - start
 
-def downloadImage(url, destinationDir):  
-    r = requests.get(url)
-    #print("Url:",url)
-    with open(destinationDir, 'wb') as img_f:
-        img_f.write(r.content)
-        #print(img_f)
+def corpus2illustrations(dois, download_prefix, data_prefix, processes = None, download_images = False,
+                         download_workers = DOWNLOAD_WORKERS, backend = 'soup',
+                         requests_per_second = REQUESTS_PER_SECOND, http_archive = None, archive_mode = 'record',
+                         cache_dir = HTTP_CACHE_DIR, image_cache_mb = IMAGE_CACHE_MB, section = 'Description',
+                         inline_figures = False):
+    '''
+    Runs xml2illustrations on the downloaded article of every DOI in dois,
+    writing data/<doi>/species-descriptions.txt as the Makefile does.
+    The articles are spread over a pool of long-lived worker processes,
+    one per available core by default, which import the parsers only once.
+    Returns a dictionary of DOI -> error for the articles that failed,
+    and prints how long the run took against the time spent on the articles.
+    '''
+    processes = processes or availableCores()
+    failures = {}
+    busy_seconds = 0.0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=initCorpusWorker,
+                             initargs=(requests_per_second, http_archive, archive_mode,
+                                       cache_dir if download_images else None, image_cache_mb,
+                                       processes)) as executor:
+        futures = {}
+        for doi in dois:
+            future = executor.submit(corpusArticle, doi2path(doi, download_prefix), doi2dataPath(doi, data_prefix),
+                                     download_images, download_workers, backend, section, inline_figures)
+            futures[future] = doi
+
+        for future in as_completed(futures):
+            doi = futures[future]
+            try:
+                busy_seconds += future.result()
+            except Exception as e:
+                failures[doi] = e
+                print('Failed to process {}: {}'.format(doi, e))
+
+    elapsed = time.perf_counter() - start
+    print('Processed {} articles in {:.2f}s with {} processes ({:.2f}s of article processing, {:.1f}x speedup)'
+          .format(len(dois), elapsed, processes, busy_seconds, busy_seconds / elapsed if elapsed else 0.0))
+    return failures
 
 if __name__ == "__main__":
     
@@ -67,13 +200,60 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process input and output files.")
 
     # Add the command-line arguments
-    parser.add_argument("input_file", help="Path to the input XML format article file")
-    parser.add_argument("output_file", help="Path to the output file")
+    parser.add_argument("input_file", nargs='?', help="Path to the input XML format article file")
+    parser.add_argument("output_file", nargs='?', help="Path to the output file")
+    # Corpus mode: process many articles at once instead of one per process
+    parser.add_argument("--corpus", default=False, action='store_true',
+                        help="Process every article downloaded into --download_prefix (corpus mode)")
+    parser.add_argument("--doi_file", help="Path to a file listing one DOI per line (corpus mode)")
+    parser.add_argument("--dois", nargs='+', help="List of DOIs to be processed (corpus mode)")
+    parser.add_argument("--download_prefix", default='downloads/', help="Directory the articles were downloaded to")
+    parser.add_argument("--data_prefix", default='data/', help="Directory used to store the output of each article")
+    parser.add_argument("--processes", type=int, help="Number of worker processes in corpus mode (default: one per core)")
     parser.add_argument("--image_dir", help="Path to the directory used to store downloaded images")
     parser.add_argument("--download_images", dest='download_images', default=False, action='store_true')
+    parser.add_argument("--cache_dir", default=HTTP_CACHE_DIR, help="Directory of the HTTP cache ('' to disable)")
+    parser.add_argument("--image_cache_mb", type=int, default=IMAGE_CACHE_MB, help="Size limit of the image cache in MB")
+    parser.add_argument("--download_workers", type=int, default=DOWNLOAD_WORKERS, help="Number of concurrent image downloads")
+    parser.add_argument("--backend", choices=list(BACKENDS), default='soup',
+                        help="Read the article with BeautifulSoup, with lxml/XPath, or streamed with lxml iterparse")
+    parser.add_argument("--streaming", dest='backend', action='store_const', const='streaming',
+                        help="Same as --backend streaming")
+    parser.add_argument("--section", default='Description', help="Title of the article section whose figures are extracted")
+    parser.add_argument("--inline_figures", default=False, action='store_true',
+                        help="Write the markup of each figure in the output file, rather than in a figure store next to it")
+    parser.add_argument("--requests_per_second", type=float, default=REQUESTS_PER_SECOND, help="Request rate limit per host")
+    parser.add_argument("--http_archive", help="Path to an HTTP archive to record responses to, or replay them from")
+    parser.add_argument("--archive_mode", choices=['record', 'replay'], default='record',
+                        help="Record responses to the HTTP archive, or replay them without network access")
     
     # Parse the command-line arguments
     args = parser.parse_args()
 
-    # Call the main function with the provided arguments
-    xml2illustrations(args.input_file, args.output_file, args.image_dir,  args.download_images)
+    corpus = args.corpus or args.doi_file or args.dois
+    if not (corpus or (args.input_file and args.output_file)):
+        parser.error('either input_file and output_file, or --corpus/--doi_file/--dois must be given')
+
+    if corpus:
+        if args.dois or args.doi_file:
+            dois = args.dois if args.dois else readDois(args.doi_file)
+        else:
+            dois = findDownloadedDois(args.download_prefix)
+        failures = corpus2illustrations(dois, args.download_prefix, args.data_prefix, args.processes,
+                                        args.download_images, args.download_workers, args.backend,
+                                        args.requests_per_second, args.http_archive, args.archive_mode,
+                                        args.cache_dir, args.image_cache_mb, args.section, args.inline_figures)
+        if failures:
+            raise SystemExit(1)
+    else:
+        configureScheduler(rate=args.requests_per_second)
+        if args.http_archive:
+            configureArchive(args.http_archive, args.archive_mode)
+        cache = None
+        # Only images are cached, so the cache is not even created unless they are downloaded
+        if args.cache_dir and args.download_images:
+            cache = HttpCache(os.path.join(args.cache_dir, 'images'), max_bytes=args.image_cache_mb * 1024 * 1024)
+
+        # Call the main function with the provided arguments
+        xml2illustrations(args.input_file, args.output_file, args.image_dir,  args.download_images, cache,
+                          args.download_workers, args.backend, args.section, args.inline_figures)